@@ -1,4 +1,7 @@
+import json
 import platform
+import re
+from collections import namedtuple
 from pathlib import Path
 
 __version__ = "0.2.0"
@@ -13,10 +16,69 @@ Path.mkdir(LARCH_TEMP, parents=True, exist_ok=True)
 Path.mkdir(LARCH_PROG_DIR, parents=True, exist_ok=True)
 Path.mkdir(LARCH_CACHE, parents=True, exist_ok=True)
 
+Repository = namedtuple("Repository", ("name", "url"))
+
 if Path(LARCH_DIR, "repo.txt").is_file():
-    LARCH_REPO = Path(LARCH_DIR, "repo.txt").read_text()
+    repo_lines = Path(LARCH_DIR, "repo.txt").read_text().splitlines()
 else:
-    LARCH_REPO = "https://github.com/alex-rusakevich/larchseed_warehouse/raw/master/"
-    Path(LARCH_DIR, "repo.txt").write_text(LARCH_REPO)
+    repo_lines = ["https://github.com/alex-rusakevich/larchseed_warehouse/raw/master/"]
+    Path(LARCH_DIR, "repo.txt").write_text(repo_lines[0])
+
+# One repository per line of repo.txt, either "<url>" or "<name> <url>". The
+# first one has the highest priority
+LARCH_REPOS = []
+# Lines that cannot be used, commands that need a repository report them
+LARCH_REPO_ERRORS = []
+
+for repo_line in repo_lines:
+    repo_line = repo_line.strip()
+
+    if not repo_line or repo_line.startswith("#"):
+        continue
+
+    repo_name, _, repo_url = repo_line.rpartition(" ")
+    repo_name = repo_name.strip()
+
+    # The name becomes a folder in LARCH_DIR/repos
+    if repo_name in (".", "..") or "/" in repo_name or "\\" in repo_name:
+        LARCH_REPO_ERRORS.append(f"'{repo_name}' cannot be a repository name")
+        continue
+
+    repo_name = re.sub(r"[^\w.-]", "_", repo_name) or (
+        "main" if not LARCH_REPOS else f"repo{len(LARCH_REPOS) + 1}"
+    )
+
+    if any(repo.name == repo_name for repo in LARCH_REPOS):
+        LARCH_REPO_ERRORS.append(f"Repository name '{repo_name}' is used twice")
+        continue
+
+    LARCH_REPOS.append(Repository(repo_name, repo_url.rstrip("/") + "/"))
+
+# Empty when repo.txt lists no repositories, commands that need one report it
+LARCH_REPO = LARCH_REPOS[0].url if LARCH_REPOS else None
 
 CURRENT_ARCH = platform.system() + "_" + platform.architecture()[0]
+
+LARCH_CONFIG = {
+    "fetch_workers": 4,
+    "cache_max_size_mb": 5120,
+    "download_retries": 3,
+    "segmented_connections": 1,
+    "segment_min_size_mb": 32,
+    "http_pool_size": 16,
+    "http_connect_timeout": 10,
+    "http_read_timeout": 60,
+    "http_retries": 3,
+    "http_backoff": 0.5,
+    "delta_max_gap": 50,
+    "index_protocol": "full",
+    "seed_bytecode_cache_size": 512,
+    "install_jobs": 4,
+    "repo_pins": {},
+    "cache_hardlinks": True,
+    "extract_workers": 4,
+    "lock_timeout": 600,
+}
+
+if Path(LARCH_DIR, "config.json").is_file():
+    LARCH_CONFIG.update(json.loads(Path(LARCH_DIR, "config.json").read_text()))
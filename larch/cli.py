@@ -1,17 +1,21 @@
 import argparse
 import sys
 
-from colorama import init
+from colorama import Fore, init
 
 import larch
-import larch.commands.clear_cache
-import larch.commands.install
-import larch.commands.run
-import larch.commands.uninstall
-import larch.commands.update
-import larch.commands.upgrade
-from larch.commands.list import list_packages
-from larch.utils import sp_print as print
+
+
+def positive_int(value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive number, got '{value}'")
+
+    return number
 
 
 def run_cli():
@@ -37,6 +41,13 @@ def run_cli():
         "install", help="install package using it's name or larchseed.py file"
     )
     install_subparser.add_argument("packages", nargs="+")
+    install_subparser.add_argument(
+        "-j",
+        "--jobs",
+        type=positive_int,
+        metavar="N",
+        help="install up to N independent packages at the same time",
+    )
     # endregion
 
     uninstall_subparser = subparsers.add_parser(
@@ -68,7 +79,68 @@ def run_cli():
         "upgrade", help="upgrade installed packages using local packages' meta info"
     )
 
-    subparsers.add_parser("clear-cache", help="remove all cached downloads")
+    clear_cache_subparser = subparsers.add_parser(
+        "clear-cache", help="remove all cached downloads"
+    )
+    clear_cache_subparser.add_argument(
+        "--max-size",
+        type=float,
+        metavar="MB",
+        help="evict least recently used downloads until the cache fits into MB",
+    )
+    clear_cache_subparser.add_argument(
+        "--older-than",
+        type=float,
+        metavar="DAYS",
+        help="remove downloads that have not been used for DAYS",
+    )
+    clear_cache_subparser.add_argument(
+        "-s",
+        "--stats",
+        action="store_true",
+        help="show cache size and hit/miss statistics and exit",
+    )
+
+    search_subparser = subparsers.add_parser(
+        "search", help="find packages in the repository by name and description"
+    )
+    search_subparser.add_argument("terms", nargs="+")
+    search_subparser.add_argument(
+        "-l",
+        "--limit",
+        type=int,
+        default=20,
+        metavar="N",
+        help="show at most N best matching packages (default: 20)",
+    )
+
+    mirror_subparser = subparsers.add_parser(
+        "mirror", help="copy packages with their seeds and sources into a folder"
+    )
+    mirror_subparser.add_argument("dir")
+    mirror_subparser.add_argument(
+        "packages",
+        nargs="*",
+        help="packages to mirror along with their dependencies (default: all)",
+    )
+    mirror_subparser.add_argument(
+        "--url",
+        metavar="URL",
+        help="address the mirror will be served from (default: its file:// URL)",
+    )
+    mirror_subparser.add_argument(
+        "-r",
+        "--repo",
+        metavar="NAME",
+        help="repository to mirror (default: the first one in repo.txt)",
+    )
+    mirror_subparser.add_argument(
+        "-j",
+        "--jobs",
+        type=positive_int,
+        metavar="N",
+        help="transfer up to N files at the same time",
+    )
 
     list_subparser = subparsers.add_parser(
         "list", help="get the list of packages and exit"
@@ -85,28 +157,91 @@ def run_cli():
         action="store_true",
         help="get list of programs which are present in the repository",
     )
+    list_subparser.add_argument(
+        "-l", "--limit", type=int, metavar="N", help="show at most N packages"
+    )
+    list_subparser.add_argument(
+        "--offset", type=int, metavar="N", help="skip the first N packages"
+    )
+    list_subparser.add_argument(
+        "-f",
+        "--format",
+        choices=("json", "ndjson", "table"),
+        help="print packages as a json array, one json object per line or a table",
+    )
 
     args = parser.parse_args()
 
     init(autoreset=True, strip=args.no_color)
 
     if args.version:
-        print(".".join((str(i) for i in larch.__version__)))
+        print(larch.__version__)
         sys.exit(0)
 
+    needs_repo = args.command in ("install", "update", "upgrade", "search", "mirror")
+    needs_repo = needs_repo or args.command == "list" and args.catalog
+    repo_txt = larch.LARCH_DIR / "repo.txt"
+
+    if needs_repo and larch.LARCH_REPO_ERRORS:
+        for error in larch.LARCH_REPO_ERRORS:
+            print(Fore.RED + f"{error} in '{repo_txt}'")
+        sys.exit(1)
+
+    if needs_repo and not larch.LARCH_REPOS:
+        print(
+            Fore.RED
+            + f"No repositories are listed in '{repo_txt}', add a repository URL to it"
+        )
+        sys.exit(1)
+
+    # Command modules are imported on demand, so that a command only pays for
+    # the databases and network setup it actually uses
     if args.command == "install":
-        larch.commands.install.install_packages(args.packages)
+        from larch.commands.install import install_packages
+
+        install_packages(args.packages, args.jobs)
     elif args.command == "uninstall":
-        larch.commands.uninstall.uninstall_pkg_names(args.packages)
+        from larch.commands.uninstall import uninstall_pkg_names
+
+        uninstall_pkg_names(args.packages)
     elif args.command == "update":
-        larch.commands.update.update_pkg_meta(args.force)
+        from larch.commands.update import update_pkg_meta
+
+        update_pkg_meta(args.force)
     elif args.command == "upgrade":
-        larch.commands.upgrade.upgrade_installed_packages()
+        from larch.commands.upgrade import upgrade_installed_packages
+
+        upgrade_installed_packages()
     elif args.command == "clear-cache":
-        larch.commands.clear_cache.clear_cache()
+        from larch.commands.clear_cache import (
+            clear_cache,
+            print_cache_stats,
+            prune_cache,
+        )
+
+        if args.stats:
+            print_cache_stats()
+        elif args.max_size is not None or args.older_than is not None:
+            prune_cache(args.max_size, args.older_than)
+        else:
+            clear_cache()
     elif args.command == "list":
-        list_packages(args.installed, args.catalog)
+        from larch.commands.list import list_packages
+
+        list_packages(
+            args.installed, args.catalog, args.limit, args.offset, args.format
+        )
+    elif args.command == "search":
+        from larch.commands.search import search_packages
+
+        search_packages(args.terms, args.limit)
+    elif args.command == "mirror":
+        from larch.commands.mirror import mirror_packages
+
+        mirror_packages(args.dir, args.packages, args.url, args.repo, args.jobs)
     elif args.command == "run":
-        larch.commands.run.run_by_name(args.detached, args.name, args.args)
+        from larch.commands.run import run_by_name
+
+        run_by_name(args.detached, args.name, args.args)
     else:
         parser.print_help()
@@ -1,22 +1,47 @@
-import os
 import shutil
+from typing import Optional
 
 from colorama import Fore
 
-from larch import LARCH_CACHE
+from larch.database.cache import cache_clear, cache_prune, get_cache_stats
+from larch.sandbox.code_cache import LARCH_SEED_BYTECODE
 from larch.utils import set_print_indentation_lvl
 from larch.utils import sp_print as print
 
 
-def get_folder_size(folder_path: str):
-    total_size = 0
+def print_cache_stats():
+    set_print_indentation_lvl(0)
+
+    stats = get_cache_stats()
+    lookups = stats["hits"] + stats["misses"]
+    hit_rate = stats["hits"] / lookups * 100 if lookups else 0
+
+    print(f"Cached entries: {stats['entries']}")
+    print(f"Cache size: {stats['size'] / (1024**2):.2f} MB")
+    print(
+        f"Hits: {stats['hits']}, misses: {stats['misses']} ({hit_rate:.1f}% hit rate)"
+    )
+
+
+def prune_cache(
+    max_size_mb: Optional[float] = None, older_than_days: Optional[float] = None
+):
+    set_print_indentation_lvl(0)
+    print("Pruning the cached downloads...")
+
+    set_print_indentation_lvl(1)
+
+    removed_count, removed_size = cache_prune(
+        max_size=None if max_size_mb is None else int(max_size_mb * 1024**2),
+        older_than=None if older_than_days is None else older_than_days * 86400,
+    )
 
-    for path, _, files in os.walk(folder_path):
-        for f in files:
-            fp = os.path.join(path, f)
-            total_size += os.path.getsize(fp)
+    print(
+        Fore.GREEN
+        + f"Done! Removed {removed_count} entries, {removed_size / (1024**2):.2f} MB data!"
+    )
 
-    return total_size
+    set_print_indentation_lvl(0)
 
 
 def clear_cache():
@@ -25,12 +50,15 @@ def clear_cache():
 
     set_print_indentation_lvl(1)
 
-    print("Calculating the cache size...", end=" ")
-    total_cache_size = get_folder_size(str(LARCH_CACHE)) / (1024**2)
-    print(Fore.GREEN + "OK", no_indentation=True)
-
     print("Removing cache files...", end=" ")
-    shutil.rmtree(LARCH_CACHE)
+    # Entries that other larch processes are using right now stay
+    removed_count, removed_size = cache_clear()
+    shutil.rmtree(LARCH_SEED_BYTECODE, ignore_errors=True)
     print(Fore.GREEN + "OK", no_indentation=True)
 
-    print(Fore.GREEN + f"Done! Removed {total_cache_size:.2f} MB data!")
+    print(
+        Fore.GREEN
+        + f"Done! Removed {removed_count} entries, {removed_size / (1024**2):.2f} MB data!"
+    )
+
+    set_print_indentation_lvl(0)
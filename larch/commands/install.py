@@ -2,22 +2,31 @@ import os
 import platform
 import shutil
 import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Set
 
 from colorama import Fore
 from sqlalchemy import delete, insert
 
-from larch import LARCH_PROG_DIR, LARCH_REPO, LARCH_TEMP
-from larch.database.local import LocalPackage
+from larch import LARCH_CONFIG, LARCH_PROG_DIR, LARCH_TEMP
+from larch.database.find_seed import fetch_remote_seed
+from larch.database.local import LocalPackage, get_installed_graph
 from larch.database.local import local_db_conn as loccon
+from larch.database.local import register_seed_meta
 from larch.database.remote import get_remote_candidate, remote_package_exists
+from larch.dep_tree.constraint import parse_requirement
 from larch.dep_tree.node import Node
+from larch.dep_tree.resolver import ResolutionError, Resolver, SeedProvider
+from larch.lock import larch_lock
 from larch.sandbox import passed_funcs
 from larch.sandbox.safe_exec import safe_exec_seed
-from larch.utils import progress_fetch, set_print_indentation_lvl
+from larch.utils import fetch_sources, set_print_indentation_lvl
 from larch.utils import sp_print as print
 
+register_lock = threading.Lock()
+
 
 def install_seed(seed_code: str) -> str:
     set_print_indentation_lvl(0)
@@ -83,11 +92,16 @@ Make sure that the folder you are trying to delete is not used by a currently ru
         + f"By installing '{loc['NAME']}', you accept it's license: {loc['LICENSE']}"
     )
 
-    for dest_file_name, download_url in loc.get("SOURCE", {}).items():
-        progress_fetch(download_url, temp_dir / dest_file_name)
+    try:
+        fetch_sources(loc.get("SOURCE", {}), temp_dir)
 
-    passed_funcs.restricted_dirs = [temp_dir, dest_dir]
-    loc["install"](temp_dir, dest_dir)  # Execute install func
+        passed_funcs.sandbox.restricted_dirs = [temp_dir, dest_dir]
+        loc["install"](temp_dir, dest_dir)  # Execute install func
+    except BaseException:
+        # A failed package leaves no half populated folders behind
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        shutil.rmtree(dest_dir, ignore_errors=True)
+        raise
 
     # region Registering package
     open(os.path.join(dest_dir, "larchseed.py"), "w", encoding="utf8").write(seed_code)
@@ -105,20 +119,21 @@ Make sure that the folder you are trying to delete is not used by a currently ru
             + f"Unknown VERSION type: {type(ver)}, allowed types are str, tuple and list"
         )
 
-    loccon.execute(delete(LocalPackage).where(LocalPackage.c.name == loc["NAME"]))
-    loccon.execute(
-        insert(LocalPackage).values(
-            name=loc["NAME"],
-            version=ver,
-            description=loc["DESCRIPTION"],
-            author=loc["AUTHOR"],
-            maintainer=loc["MAINTAINER"],
-            url=loc["URL"],
-            license=loc["LICENSE"],
-            entry_point=entry_point,
+    with register_lock:
+        loccon.execute(delete(LocalPackage).where(LocalPackage.c.name == loc["NAME"]))
+        loccon.execute(
+            insert(LocalPackage).values(
+                name=loc["NAME"],
+                version=ver,
+                description=loc["DESCRIPTION"],
+                author=loc["AUTHOR"],
+                maintainer=loc["MAINTAINER"],
+                url=loc["URL"],
+                license=loc["LICENSE"],
+                entry_point=entry_point,
+            )
         )
-    )
-    loccon.commit()
+        register_seed_meta(loc["NAME"], loc)
     # endregion
 
     print(Fore.GREEN + f"'{loc['NAME']}=={ver}' was installed successfully!")
@@ -129,27 +144,17 @@ Make sure that the folder you are trying to delete is not used by a currently ru
     set_print_indentation_lvl(0)
 
 
-def install_pkg(pkg_name: str, desired_ver: Optional[Tuple[str, str]] = None):
-    # region Skipping installed
-    pkg_str = pkg_name
+def install_pkg(pkg_str: str):
+    pkg_str, pkg_name, constraints = parse_requirement(pkg_str)
 
-    if desired_ver and desired_ver[0] and desired_ver[1]:
-        pkg_str += desired_ver[0] + desired_ver[1]
-
-    for node in Node.all_nodes:
-        if node.pkg_str == pkg_str:
-            if node.node_type == Node.NodeType.INSTALLED:
-                return
+    # region Skipping installed
+    node = Node.resolved.get((pkg_name, constraints), None)
 
-            break
+    if node is not None and node.node_type == Node.NodeType.INSTALLED:
+        return
     # endregion
 
-    ver_str = ""
-
-    if desired_ver is not None:
-        ver_str = "".join(desired_ver)
-
-    print(f"Installing '{pkg_name}{ver_str}'...")
+    print(f"Installing '{pkg_str}'...")
 
     set_print_indentation_lvl(1)
 
@@ -157,66 +162,118 @@ def install_pkg(pkg_name: str, desired_ver: Optional[Tuple[str, str]] = None):
         print(Fore.RED + f"Remote package with name '{pkg_name}' does not exist")
         sys.exit(1)
 
-    remote_pkg = get_remote_candidate(pkg_name, desired_ver)
+    remote_pkg = get_remote_candidate(pkg_name, constraints)
 
     if remote_pkg is None:
         print(
             Fore.RED
-            + f"No candidate for package '{pkg_name}{ver_str}' was found for your system."
+            + f"No candidate for package '{pkg_str}' was found for your system."
         )
         sys.exit(1)
     else:
         print(Fore.GREEN + f"Found package: {remote_pkg.name}=={remote_pkg.ver}")
 
-    seed_path = os.path.join(
-        LARCH_TEMP,
-        ".seeds",
-        remote_pkg.name,
-        remote_pkg.ver,
-        remote_pkg.arch,
-        "larchseed.py",
-    )
-    Path(os.path.dirname(seed_path)).mkdir(parents=True, exist_ok=True)
+    install_seed(fetch_remote_seed(remote_pkg))
 
-    progress_fetch(
-        LARCH_REPO
-        + f"packages/{remote_pkg.name}/{remote_pkg.ver}/{remote_pkg.arch}/larchseed.py",
-        seed_path,
-    )
 
-    install_seed(Path(seed_path).read_text())
-    os.remove(seed_path)
+def _cancel_dependents(node: Node, waiting_on: Dict[Node, Set[Node]]) -> List[Node]:
+    cancelled = []
+    queue = [node]
+
+    while queue:
+        for parent in queue.pop(0).parents:
+            if parent in waiting_on:
+                del waiting_on[parent]
+                cancelled.append(parent)
+                queue.append(parent)
+
+    return cancelled
 
 
-def _install_packages():
+def _install_packages(jobs: int) -> bool:
     set_print_indentation_lvl(0)
 
-    current_queue = []
-    next_queue = []
+    # Installed packages are satisfied dependencies already, only remote ones
+    # are scheduled. A package waits until all of its dependencies are done
+    waiting_on: Dict[Node, Set[Node]] = {
+        node: set() for node in Node.all_nodes if node.node_type == Node.NodeType.REMOTE
+    }
+
+    for node, deps in waiting_on.items():
+        deps.update(child for child in node.children if child in waiting_on)
+
+    running = {}
+    is_successful = True
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while True:
+            for node in [node for node, deps in waiting_on.items() if not deps]:
+                del waiting_on[node]
+                running[executor.submit(install_seed, node.seed_code)] = node
+
+            if not running:
+                break
 
-    for node in Node.all_nodes:
-        if node.children == []:
-            current_queue.append(node)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
 
-    while len(current_queue) > 0:
-        for node in current_queue:
-            if node.name in ("@user", "@local"):
-                continue
+            for future in done:
+                node = running.pop(future)
+                error = future.exception()
 
-            if node.node_type == Node.NodeType.REMOTE:
-                install_seed(node.seed_code)
+                if error is None:
+                    for parent in node.parents:
+                        waiting_on.get(parent, set()).discard(node)
 
-            next_queue = [*next_queue, *node.parents]
+                    continue
 
-        current_queue = next_queue
-        next_queue = []
+                is_successful = False
 
+                if not isinstance(error, SystemExit):
+                    print(Fore.RED + f"{type(error).__name__}: {error}")
 
-def install_packages(pkg_names: List[str]):
+                print(Fore.RED + f"Failed to install '{node.pkg_str}'")
+
+                cancelled = _cancel_dependents(node, waiting_on)
+
+                cancelled and print(
+                    Fore.YELLOW
+                    + "Cancelled the following package(s) depending on it: "
+                    + "; ".join(parent.pkg_str for parent in cancelled)
+                )
+
+    if waiting_on:
+        is_successful = False
+        print(
+            Fore.RED
+            + "Dependency cycle between the following package(s): "
+            + "; ".join(node.pkg_str for node in waiting_on)
+        )
+
+    return is_successful
+
+
+def install_packages(pkg_names: List[str], jobs: Optional[int] = None):
     set_print_indentation_lvl(0)
 
-    user_root = Node([], list(Node([], [], pkg_str) for pkg_str in pkg_names), "@user")
-    Node.shake_tree()
+    with larch_lock():
+        try:
+            _resolve_and_install(pkg_names, jobs)
+        finally:
+            # Packages installed before a failure are kept and registered
+            loccon.commit()
+
+
+def _resolve_and_install(pkg_names: List[str], jobs: Optional[int]):
+    provider = SeedProvider()
+    installed = [f"{pkg.name}=={pkg.version}" for pkg in get_installed_graph().values()]
+
+    try:
+        solution = Resolver(provider).resolve({"@local": installed, "@user": pkg_names})
+    except ResolutionError as e:
+        print(Fore.RED + f"{e}. Stopping")
+        sys.exit(1)
+
+    user_root = Node.from_solution("@user", pkg_names, solution, provider)
 
     # pprint(Node.all_nodes)
 
@@ -241,4 +298,5 @@ def install_packages(pkg_names: List[str]):
         print(
             "Installing the following package(s): " + Fore.GREEN + "; ".join(installing)
         )
-        _install_packages()
+        if not _install_packages(jobs or LARCH_CONFIG["install_jobs"]):
+            sys.exit(1)
@@ -1,42 +1,173 @@
+import heapq
+import json
+import os
 import sys
+from itertools import chain, islice
+from typing import List, Optional
 
 from colorama import Fore
-from sqlalchemy import select
-from tabulate import tabulate
+from sqlalchemy import func, select
 
+from larch import LARCH_CONFIG, LARCH_REPOS
 from larch.database.local import LocalPackage
 from larch.database.local import local_db_conn as loccon
-from larch.database.remote import RemotePkgMeta
-from larch.database.remote import remote_db_conn as remcon
 
+# Rows are read and printed in batches, the full list is never held in memory
+FETCH_BATCH_SIZE = 1000
 
-def list_packages(list_installed=False, list_catalog=False):
+
+def get_table_layout(conn, query, headers: List[str]):
+    page = query.subquery()
+
+    # One aggregate pass gives the column widths before the first row is
+    # printed, so that the table can be streamed
+    count, *widths = conn.execute(
+        select(
+            func.count(),
+            *(func.coalesce(func.max(func.length(column)), 0) for column in page.c),
+        )
+    ).one()
+
+    return count, [max(width, len(header)) for width, header in zip(widths, headers)]
+
+
+def write_table_row(output, values, widths: List[int]):
+    output.write(
+        "| "
+        + " | ".join(str(value).ljust(width) for value, width in zip(values, widths))
+        + " |\n"
+    )
+
+
+def merge_catalogs(repo_rows):
+    pins = LARCH_CONFIG["repo_pins"]
+    last_name = None
+
+    # Every catalog is ordered by name, the first repository that has a package
+    # shadows the others unless the package is pinned
+    for row, repo in heapq.merge(*repo_rows, key=lambda item: item[0].name):
+        if row.name == last_name or pins.get(row.name, repo.name) != repo.name:
+            continue
+
+        last_name = row.name
+        yield row
+
+
+def stream_rows(
+    output, rows, output_format: str, headers: List[str], widths: List[int]
+):
+    if output_format == "ndjson":
+        for row in rows:
+            output.write(json.dumps(row._asdict(), ensure_ascii=False) + "\n")
+    elif output_format == "json":
+        output.write("[")
+
+        for i, row in enumerate(rows):
+            output.write(
+                ("," if i else "")
+                + "\n  "
+                + json.dumps(row._asdict(), ensure_ascii=False)
+            )
+
+        output.write("\n]\n")
+    elif output_format == "table":
+        write_table_row(output, headers, widths)
+        output.write("|" + "|".join("-" * (width + 2) for width in widths) + "|\n")
+
+        for row in rows:
+            write_table_row(output, row, widths)
+    else:
+        for row in rows:
+            output.write(f"{row.name}=={row.version}\n")
+
+
+def list_packages(
+    list_installed=False,
+    list_catalog=False,
+    limit: Optional[int] = None,
+    offset: Optional[int] = None,
+    output_format: Optional[str] = None,
+):
     if list_installed and list_catalog:
         print(Fore.RED + "Only one type of list can be shown in single run")
         sys.exit(1)
 
     if list_installed:
-        inst_list = loccon.execute(select(LocalPackage).order_by("name"))
-
-        if inst_list == []:
-            print("No packages installed yet")
-        else:
-            for pkg in inst_list:
-                pkg_name = pkg.name
-                pkg_ver = pkg.version
-
-                print(f"{pkg_name}=={pkg_ver}")
+        sources = [loccon]
+        query = select(
+            LocalPackage.c.name,
+            LocalPackage.c.version,
+            LocalPackage.c.description,
+            LocalPackage.c.author,
+            LocalPackage.c.maintainer,
+            LocalPackage.c.url,
+            LocalPackage.c.license,
+            LocalPackage.c.entry_point,
+        ).order_by(LocalPackage.c.name)
+        headers = ["Name", "Version"]
+        empty_message = "No packages installed yet"
     elif list_catalog:
-        catalog_packages = remcon.execute(select(RemotePkgMeta).order_by("name"))
-        print(
-            tabulate(
-                ((row[1], row[2].replace("\n", " ")) for row in catalog_packages),
-                headers=["Name", "Description"],
-                tablefmt="github",
-            )
-        )
+        from larch.database.remote import RemotePkgMeta, get_remote_db_conn
+
+        sources = [get_remote_db_conn(repo) for repo in LARCH_REPOS]
+        query = select(
+            RemotePkgMeta.c.name,
+            func.replace(RemotePkgMeta.c.desc, "\n", " ").label("description"),
+        ).order_by(RemotePkgMeta.c.name)
+        headers = ["Name", "Description"]
+        output_format = output_format or "table"
+        empty_message = "The catalog is empty, try running 'larch update'"
     else:
         print(
             Fore.RED + "Package list type hasn't been specified, please, consult --help"
         )
         sys.exit(1)
+
+    if len(sources) == 1:
+        query = query.limit(limit).offset(offset)
+    elif limit is not None:
+        # Shadowed packages are only dropped after merging, so every catalog
+        # has to provide the whole window
+        query = query.limit((offset or 0) + limit)
+
+    widths = []
+
+    if output_format == "table":
+        query = query.with_only_columns(*query.selected_columns[: len(headers)])
+        layouts = [get_table_layout(conn, query, headers)[1] for conn in sources]
+        widths = [max(column) for column in zip(*layouts)]
+
+    query = query.execution_options(yield_per=FETCH_BATCH_SIZE)
+
+    if len(sources) == 1:
+        rows = iter(sources[0].execute(query))
+    else:
+        rows = islice(
+            merge_catalogs(
+                ((row, repo) for row in conn.execute(query))
+                for conn, repo in zip(sources, LARCH_REPOS)
+            ),
+            offset or 0,
+            None if limit is None else (offset or 0) + limit,
+        )
+
+    first_row = next(rows, None)
+
+    if first_row is None and output_format in (None, "table"):
+        # An empty json list is a valid answer already
+        print(empty_message if not offset else f"No packages past offset {offset}")
+        return
+
+    rows = chain([first_row], rows) if first_row is not None else rows
+
+    # colorama's wrapper of sys.stdout appends a color reset to every write,
+    # the rows are plain data and go around it
+    output = sys.__stdout__
+
+    try:
+        stream_rows(output, rows, output_format, headers, widths)
+        output.flush()
+    except BrokenPipeError:
+        # The reader went away (e.g. '| head'), which is not an error
+        os.dup2(os.open(os.devnull, os.O_WRONLY), output.fileno())
+        sys.exit(0)
@@ -0,0 +1,362 @@
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import requests
+import sqlalchemy as db
+from colorama import Fore
+from sqlalchemy import insert, select, text
+
+from larch import LARCH_CONFIG, LARCH_REPOS, Repository
+from larch.commands.update import update_pkg_meta
+from larch.database.remote import (
+    REMOTE_DB_SCHEMA_VERSION,
+    RemotePackage,
+    RemotePkgMeta,
+    constraint_to_sql,
+    get_remote_db_conn,
+    metadata,
+)
+from larch.database.repos import get_repo_by_name
+from larch.dep_tree.constraint import parse_requirement
+from larch.sandbox.safe_exec import safe_exec_seed
+from larch.session import http_get
+from larch.utils import progress_fetch_many, set_print_indentation_lvl
+from larch.utils import sp_print as print
+
+# What the previous sync has put into the mirror, so that the next one only
+# transfers what has changed since
+MIRROR_MANIFEST = ".larch-mirror.json"
+
+
+def get_pkg_key(pkg) -> str:
+    return f"{pkg.name}/{pkg.ver}/{pkg.arch}"
+
+
+def read_manifest(mirror_dir: Path) -> dict:
+    try:
+        return json.loads((mirror_dir / MIRROR_MANIFEST).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def write_if_changed(path: Path, data: bytes) -> bool:
+    if path.is_file() and path.read_bytes() == data:
+        return False  # Left alone, so that its mtime and validators stay the same
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+
+    try:
+        with os.fdopen(temp_fd, "wb") as output:
+            output.write(data)
+
+        os.replace(temp_path, path)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+
+    return True
+
+
+def select_versions(conn, pkg_str: str) -> list:
+    requirement = parse_requirement(pkg_str)
+
+    rows = list(
+        conn.execute(
+            select(RemotePackage)
+            .where(RemotePackage.c.name == requirement.name)
+            .where(
+                *(
+                    constraint_to_sql(*constraint)
+                    for constraint in requirement.constraints
+                )
+            )
+        )
+    )
+
+    if not rows:
+        print(Fore.YELLOW + f"No versions of '{pkg_str}' were found, skipping")
+
+    return rows
+
+
+def fetch_seed(repo: Repository, pkg, entry: Optional[dict], seed_path: Path):
+    headers = {}
+
+    if entry is not None and seed_path.is_file():
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    r = http_get(
+        repo.url + f"packages/{pkg.name}/{pkg.ver}/{pkg.arch}/larchseed.py",
+        headers=headers,
+    )
+
+    if r.status_code == 304:
+        return None
+
+    r.raise_for_status()
+
+    return r
+
+
+def rewrite_sources(seed_code: str, sources: Dict[str, str]) -> str:
+    # The seed may build SOURCE in any way it likes, so the evaluated value is
+    # assigned once more at the very end instead of editing the original one
+    return (
+        seed_code.rstrip("\n")
+        + "\n\n# Rewritten by 'larch mirror'\n"
+        + f"SOURCE = {sources!r}\n"
+    )
+
+
+def get_source_files(sources: Dict[str, str], pkg_key: str) -> List[str]:
+    for file_name in sources:
+        if Path(file_name).name != file_name or file_name in ("", ".", ".."):
+            print(Fore.RED + f"'{pkg_key}' has a bad SOURCE file name '{file_name}'")
+            sys.exit(1)
+
+    return list(sources)
+
+
+def sync_seeds(
+    repo: Repository,
+    conn,
+    pkg_strs: List[str],
+    mirror_dir: Path,
+    base_url: str,
+    old_seeds: dict,
+    jobs: int,
+) -> dict:
+    if pkg_strs:
+        pending = [
+            row for pkg_str in pkg_strs for row in select_versions(conn, pkg_str)
+        ]
+    else:
+        pending = list(conn.execute(select(RemotePackage)))
+
+    seeds = {}
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # Every round fetches the seeds of the dependencies found in the last one
+        while pending:
+            pkgs = list({get_pkg_key(pkg): pkg for pkg in pending}.values())
+            pkgs = [pkg for pkg in pkgs if get_pkg_key(pkg) not in seeds]
+            pending = []
+
+            responses = executor.map(
+                lambda pkg: fetch_seed(
+                    repo,
+                    pkg,
+                    old_seeds.get(get_pkg_key(pkg)),
+                    mirror_dir / "packages" / get_pkg_key(pkg) / "larchseed.py",
+                ),
+                pkgs,
+            )
+
+            for pkg, r in zip(pkgs, responses):
+                pkg_key = get_pkg_key(pkg)
+
+                if r is None:
+                    entry = {**old_seeds[pkg_key], "row": dict(pkg._mapping)}
+                else:
+                    seed_code = r.content.decode("utf8")
+                    loc = safe_exec_seed(seed_code)
+                    sources = dict(loc.get("SOURCE", {}))
+                    entry = {
+                        "row": dict(pkg._mapping),
+                        "etag": r.headers.get("ETag"),
+                        "last_modified": r.headers.get("Last-Modified"),
+                        "sources": sources,
+                        "dependencies": list(loc.get("DEPENDENCIES", [])),
+                    }
+
+                    mirrored_sources = {
+                        file_name: base_url + f"packages/{pkg_key}/sources/{file_name}"
+                        for file_name in get_source_files(sources, pkg_key)
+                    }
+                    write_if_changed(
+                        mirror_dir / "packages" / pkg_key / "larchseed.py",
+                        rewrite_sources(seed_code, mirrored_sources).encode("utf8"),
+                    )
+
+                seeds[pkg_key] = entry
+
+                for dep_str in entry["dependencies"]:
+                    pending += select_versions(conn, dep_str)
+
+    return seeds
+
+
+def sync_sources(mirror_dir: Path, seeds: dict, old_seeds: dict, jobs: int):
+    files = {}
+
+    for pkg_key, entry in seeds.items():
+        sources_dir = mirror_dir / "packages" / pkg_key / "sources"
+        old_sources = old_seeds.get(pkg_key, {}).get("sources", {})
+
+        for file_name in old_sources.keys() - entry["sources"].keys():
+            (sources_dir / file_name).unlink(missing_ok=True)  # Dropped by the seed
+
+        for file_name, url in entry["sources"].items():
+            if (
+                old_sources.get(file_name) != url
+                or not (sources_dir / file_name).is_file()
+            ):
+                files[sources_dir / file_name] = url
+
+    if not files:
+        return
+
+    for dest in files:
+        dest.parent.mkdir(parents=True, exist_ok=True)
+
+    try:
+        progress_fetch_many(files, max_workers=jobs, no_cache=True)
+    except (requests.RequestException, OSError) as e:
+        print(Fore.RED + f"Failed to fetch package sources: {e}")
+        sys.exit(1)
+
+
+def write_indexes(conn, mirror_dir: Path, seeds: dict):
+    rows = sorted(
+        (entry["row"] for entry in seeds.values()),
+        key=lambda row: (row["name"], row["ver_key"]),
+    )
+    pkg_names = sorted({row["name"] for row in rows})
+
+    # Sparse indexes list the newest version first
+    for pkg_name in pkg_names:
+        versions = [
+            {"ver": row["ver"], "arch": row["arch"]}
+            for row in reversed(rows)
+            if row["name"] == pkg_name
+        ]
+        write_if_changed(
+            mirror_dir / "packages" / pkg_name / "index.json",
+            json.dumps({"versions": versions}).encode("utf8"),
+        )
+
+    temp_fd, temp_path = tempfile.mkstemp(dir=mirror_dir, suffix=".tmp")
+    os.close(temp_fd)
+
+    engine = db.create_engine(f"sqlite:///{temp_path}")
+
+    try:
+        with engine.begin() as mirror_conn:
+            metadata.create_all(mirror_conn)
+
+            if rows:
+                mirror_conn.execute(insert(RemotePackage), rows)
+
+            pkg_meta_rows = [
+                dict(row._mapping)
+                for row in conn.execute(
+                    select(RemotePkgMeta).where(RemotePkgMeta.c.name.in_(pkg_names))
+                )
+            ]
+
+            if pkg_meta_rows:
+                mirror_conn.execute(insert(RemotePkgMeta), pkg_meta_rows)
+
+            mirror_conn.execute(
+                text(f"PRAGMA user_version = {REMOTE_DB_SCHEMA_VERSION}")
+            )
+
+        remote_db = Path(temp_path).read_bytes()
+    finally:
+        engine.dispose()
+        Path(temp_path).unlink(missing_ok=True)
+
+    write_if_changed(mirror_dir / "remote.db", remote_db)
+    write_if_changed(mirror_dir / "remote.db.gz", gzip.compress(remote_db, mtime=0))
+
+
+def prune_mirror(mirror_dir: Path, seeds: dict, old_seeds: dict):
+    pkg_names = {entry["row"]["name"] for entry in seeds.values()}
+
+    for pkg_key in old_seeds.keys() - seeds.keys():
+        shutil.rmtree(mirror_dir / "packages" / pkg_key, ignore_errors=True)
+
+        pkg_dir = mirror_dir / "packages" / pkg_key.split("/")[0]
+
+        if pkg_dir.name not in pkg_names:
+            shutil.rmtree(pkg_dir, ignore_errors=True)
+        else:
+            # Only the version folder is left behind if it has no other builds
+            ver_dir = mirror_dir / "packages" / pkg_key.rsplit("/", 1)[0]
+
+            if ver_dir.is_dir() and not any(ver_dir.iterdir()):
+                ver_dir.rmdir()
+
+
+def mirror_packages(
+    mirror_dir: str,
+    pkg_strs: List[str],
+    base_url: Optional[str] = None,
+    repo_name: Optional[str] = None,
+    jobs: Optional[int] = None,
+):
+    set_print_indentation_lvl(0)
+
+    repo = LARCH_REPOS[0] if repo_name is None else get_repo_by_name(repo_name)
+
+    if repo is None:
+        print(Fore.RED + f"Unknown repository '{repo_name}'")
+        sys.exit(1)
+
+    mirror_dir = Path(mirror_dir).resolve()
+    mirror_dir.mkdir(parents=True, exist_ok=True)
+
+    base_url = (base_url or mirror_dir.as_uri()).rstrip("/") + "/"
+    jobs = jobs or LARCH_CONFIG["fetch_workers"]
+
+    update_pkg_meta(repos=[repo])
+    conn = get_remote_db_conn(repo)
+
+    manifest = read_manifest(mirror_dir)
+
+    old_seeds = manifest.get("seeds", {})
+
+    # Seeds fetched for another address have that address baked into them,
+    # sources are kept as long as their original URLs are the same
+    if manifest.get("base_url") != base_url:
+        seed_validators = {}
+    else:
+        seed_validators = old_seeds
+
+    set_print_indentation_lvl(0)
+    print(f"Mirroring '{repo.url}' to '{mirror_dir}'...")
+    set_print_indentation_lvl(1)
+
+    try:
+        seeds = sync_seeds(
+            repo, conn, pkg_strs, mirror_dir, base_url, seed_validators, jobs
+        )
+    except requests.RequestException as e:
+        print(Fore.RED + f"Failed to fetch seeds: {e}")
+        sys.exit(1)
+
+    sync_sources(mirror_dir, seeds, old_seeds, jobs)
+    write_indexes(conn, mirror_dir, seeds)
+    prune_mirror(mirror_dir, seeds, old_seeds)
+
+    write_if_changed(
+        mirror_dir / MIRROR_MANIFEST,
+        json.dumps({"base_url": base_url, "seeds": seeds}, indent=1).encode("utf8"),
+    )
+
+    set_print_indentation_lvl(0)
+    print(
+        Fore.GREEN
+        + f"Mirrored {len(seeds)} package build(s), add '{base_url}' to repo.txt to use it"
+    )
@@ -6,20 +6,22 @@ from colorama import Fore
 from sqlalchemy import select
 
 from larch import LARCH_PROG_DIR
-from larch.database.local import LocalPackage, local_db_engine
+from larch.database.local import LocalPackage
+from larch.database.local import local_db_conn as loccon
 
 
 def run_by_name(is_detached, name, args_list):
-    with local_db_engine.connect() as connection:
-        prog = connection.execute(
-            select(LocalPackage).where(LocalPackage.c.name == name)
-        ).one_or_none()
+    prog = loccon.execute(
+        select(LocalPackage).where(LocalPackage.c.name == name)
+    ).one_or_none()
+    # The program may run for long, its read must not hold a snapshot of local.db
+    loccon.rollback()
 
     if prog is None:
         print(Fore.RED + f"Package '{name}' does not exist, stopping")
         sys.exit(1)
 
-    if prog.executable is None:
+    if prog.entry_point is None:
         print(Fore.RED + f"No executable registered for the package '{name}'")
         sys.exit(1)
 
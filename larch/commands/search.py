@@ -0,0 +1,54 @@
+from typing import List
+
+from colorama import Fore, Style
+from tabulate import tabulate
+
+from larch import LARCH_REPOS
+from larch.database.search import (
+    is_search_index_stale,
+    refresh_search_index,
+    search_catalog,
+)
+
+
+def search_packages(terms: List[str], limit=20):
+    from larch.database.remote import get_package_repo, get_remote_db_conn
+
+    results = []
+
+    for repo in LARCH_REPOS:
+        get_remote_db_conn(repo)  # Fetches remote.db if there is none yet
+
+        if is_search_index_stale(repo):
+            refresh_search_index(repo)
+
+        results += [
+            (row, repo)
+            for row in search_catalog(repo, terms, limit, (Fore.GREEN, Style.RESET_ALL))
+        ]
+
+    if len(LARCH_REPOS) > 1:
+        # Only the repository a package would be installed from is shown
+        results = [
+            (row, repo)
+            for row, repo in results
+            if get_package_repo(row.pkg_name) in (repo, None)
+        ]
+
+    # bm25 ranks are negative, the best match has the lowest one
+    results = sorted(results, key=lambda result: result[0].rank)[:limit]
+
+    if not results:
+        print(Fore.YELLOW + f"No packages matching '{' '.join(terms)}' were found")
+        return
+
+    headers = ["Name", "Description"]
+    table = [[row.name, row.snippet.replace("\n", " ")] for row, _ in results]
+
+    if len(LARCH_REPOS) > 1:
+        headers.append("Repository")
+
+        for table_row, (_, repo) in zip(table, results):
+            table_row.append(repo.name)
+
+    print(tabulate(table, headers=headers, tablefmt="github"))
@@ -7,13 +7,15 @@ from colorama import Fore
 from sqlalchemy import delete
 
 from larch import LARCH_PROG_DIR, LARCH_TEMP
+from larch.database.find_seed import get_installed_package
 from larch.database.local import LocalPackage
 from larch.database.local import local_db_conn as loccon
-from larch.database.local import package_installed
+from larch.database.local import package_installed, unregister_seed_meta
 from larch.dep_tree.node import Node
+from larch.lock import larch_lock
 from larch.sandbox import passed_funcs
 from larch.sandbox.safe_exec import safe_exec_seed
-from larch.utils import progress_fetch, set_print_indentation_lvl
+from larch.utils import fetch_sources, set_print_indentation_lvl
 from larch.utils import sp_print as print
 
 
@@ -29,24 +31,23 @@ def uninstall_pkg_name(pkg_name: str):
         sys.exit(1)
 
     # region Execute uninstall procedure
-    loc = safe_exec_seed(Path(LARCH_PROG_DIR / pkg_name, "larchseed.py").read_text())
-
     temp_dir = Path(LARCH_TEMP / pkg_name)
     dest_dir = Path(LARCH_PROG_DIR / pkg_name)
 
     temp_dir.mkdir(parents=True, exist_ok=True)
 
-    if callable(loc.get("uninstall", None)):
-        for dest_file_name, download_url in loc.get("SOURCE", {}).items():
-            progress_fetch(download_url, temp_dir / dest_file_name)
+    if get_installed_package(pkg_name).has_uninstall:
+        loc = safe_exec_seed(Path(dest_dir, "larchseed.py").read_text())
+
+        fetch_sources(loc.get("SOURCE", {}), temp_dir)
 
-        passed_funcs.restricted_dirs = [temp_dir, dest_dir]
+        passed_funcs.sandbox.restricted_dirs = [temp_dir, dest_dir]
         loc["uninstall"](temp_dir, dest_dir)
     # endregion
 
     # region Unregister package
     loccon.execute(delete(LocalPackage).where(LocalPackage.c.name == pkg_name))
-    loccon.commit()
+    unregister_seed_meta(pkg_name)
     # endregion
 
     # region Cleaning
@@ -62,19 +63,28 @@ def uninstall_pkg_name(pkg_name: str):
 def uninstall_pkg_names(pkg_names: List[str]):
     set_print_indentation_lvl(0)
 
-    Node([], list(Node([], [], pkg_str) for pkg_str in pkg_names), "@user")
+    with larch_lock():
+        try:
+            _uninstall_pkg_names(pkg_names)
+        finally:
+            # Packages removed before a failure stay unregistered
+            loccon.commit()
+
+
+def _uninstall_pkg_names(pkg_names: List[str]):
+    Node.load_local()
+    Node.create_root("@user", pkg_names)
 
     Node.shake_tree()
 
     for pkg_name in pkg_names:
         broken_parent_pkg = []
+        node = Node.index.get(pkg_name, None)
 
-        for node in Node.all_nodes:
-            if node.name == pkg_name:  # Found corresponding node in the tree
-                for node_parent in node.parents:
-                    if node_parent.name not in ("@user", "@local", *pkg_names):
-                        broken_parent_pkg.append(node_parent)
-                break
+        if node is not None:  # Found corresponding node in the tree
+            for node_parent in node.parents:
+                if node_parent.name not in ("@user", "@local", *pkg_names):
+                    broken_parent_pkg.append(node_parent)
 
         if broken_parent_pkg:
             broken_parent_pkg_names = "; ".join(set(i.name for i in broken_parent_pkg))
@@ -1,32 +1,329 @@
+import json
 import os
-from datetime import datetime
+import sys
+import tempfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import List, Optional
 
 import requests
+import sqlalchemy as db
 from colorama import Fore
-from dateutil import parser
+from sqlalchemy import delete, insert, text
+from sqlalchemy.exc import SQLAlchemyError
+from tqdm.auto import tqdm
 
-from larch import LARCH_DIR, LARCH_REPO
-from larch.utils import HEADERS, progress_fetch, set_print_indentation_lvl
+from larch import LARCH_CONFIG, LARCH_REPOS, Repository
+from larch.database.repos import get_remote_db_path, get_repo_dir
+from larch.database.search import refresh_search_index
+from larch.dep_tree.version import Version
+from larch.session import http_get
+from larch.utils import CHUNK_SIZE, set_print_indentation_lvl
 from larch.utils import sp_print as print
 
+try:
+    import zstandard
+except ImportError:  # zstd-compressed indexes are only used when it is installed
+    zstandard = None
 
-def get_remote_timestamp():
-    print("Getting remote timestamp...", end=" ")
-    r = requests.get(LARCH_REPO + ".remote-db-timestamp", headers=HEADERS)
-    timestamp = r.content.decode("utf-8")
+DELTA_TABLES = ("packages", "pkg_meta")
 
-    print(Fore.GREEN + "OK" + Fore.RESET, no_indentation=True)
 
-    return parser.parse(timestamp.strip())
+class _IdentityDecompressor:
+    def decompress(self, data: bytes) -> bytes:
+        return data
 
+    def flush(self) -> bytes:
+        return b""
 
-def fetch_remote_db():
-    print("Fetching remote package info...")
-    progress_fetch(LARCH_REPO + "remote.db", LARCH_DIR / "remote.db", no_cache=True)
 
+def get_remote_db_variants():
+    variants = []
 
-def update_pkg_meta(is_forced=False):
+    if zstandard is not None:
+        variants.append(
+            ("remote.db.zst", lambda: zstandard.ZstdDecompressor().decompressobj())
+        )
+
+    variants.append(
+        ("remote.db.gz", lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)),
+    )
+    variants.append(("remote.db", _IdentityDecompressor))
+
+    return variants
+
+
+def get_validators_path(repo: Repository) -> Path:
+    return get_repo_dir(repo) / ".remote-db-validators"
+
+
+def read_validators(repo: Repository) -> dict:
+    try:
+        return json.loads(get_validators_path(repo).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def fetch_remote_db(repo: Repository, is_forced=False) -> bool:
+    remote_db_path = get_remote_db_path(repo)
+    validators = {}
+
+    if not is_forced and remote_db_path.is_file():
+        validators = read_validators(repo)
+
+    variants = get_remote_db_variants()
+    # The file the current copy came from goes first, so that an unchanged
+    # index costs a single 304 instead of a 404 for every other variant
+    variants.sort(key=lambda variant: variant[0] != validators.get("file"))
+
+    for i, (file_name, get_decompressor) in enumerate(variants):
+        headers = {"Accept-Encoding": "gzip"}
+
+        if validators.get("file") == file_name:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+
+        with http_get(repo.url + file_name, stream=True, headers=headers) as r:
+            if r.status_code == 404 and i < len(variants) - 1:
+                continue
+
+            if r.status_code == 304:
+                return False
+
+            r.raise_for_status()
+
+            print(f"[{repo.name}] Fetching remote package info from '{file_name}'...")
+
+            decompressor = get_decompressor()
+            temp_fd, temp_path = tempfile.mkstemp(
+                dir=remote_db_path.parent, prefix=".remote.db.", suffix=".tmp"
+            )
+
+            try:
+                with os.fdopen(temp_fd, "wb") as output, tqdm(
+                    total=int(r.headers.get("Content-Length", 0)) or None,
+                    unit="B",
+                    unit_scale=True,
+                    unit_divisor=1024,
+                    desc=repo.name,
+                ) as progress:
+                    # Transport-level gzip is undone by requests as the chunks arrive
+                    for chunk in r.raw.stream(CHUNK_SIZE, decode_content=True):
+                        output.write(decompressor.decompress(chunk))
+                        progress.update(r.raw.tell() - progress.n)
+
+                    output.write(decompressor.flush())
+                    output.flush()
+                    os.fsync(output.fileno())
+
+                # Readers keep their already opened remote.db until they reconnect
+                os.replace(temp_path, remote_db_path)
+            except BaseException:
+                Path(temp_path).unlink(missing_ok=True)
+                raise
+
+            get_validators_path(repo).write_text(
+                json.dumps(
+                    {
+                        "file": file_name,
+                        "etag": r.headers.get("ETag"),
+                        "last_modified": r.headers.get("Last-Modified"),
+                    }
+                )
+            )
+
+            return True
+
+
+def get_local_seq(repo: Repository) -> Optional[int]:
+    if not get_remote_db_path(repo).is_file():
+        return None
+
+    engine = db.create_engine(f"sqlite:///{get_remote_db_path(repo)}")
+
+    try:
+        with engine.connect() as conn:
+            if not db.inspect(conn).has_table("db_meta"):
+                return None
+
+            seq = conn.execute(
+                text("SELECT value FROM db_meta WHERE key = 'seq'")
+            ).scalar()
+    finally:
+        engine.dispose()
+
+    return None if seq is None else int(seq)
+
+
+def get_remote_seq(repo: Repository) -> Optional[int]:
+    r = http_get(repo.url + "deltas/latest")
+
+    if r.status_code == 404:
+        return None
+
+    r.raise_for_status()
+
+    return int(r.text.strip())
+
+
+def fetch_delta(repo: Repository, seq: int) -> Optional[dict]:
+    r = http_get(repo.url + f"deltas/{seq}.json")
+
+    if r.status_code == 404:
+        return None
+
+    r.raise_for_status()
+
+    return r.json()
+
+
+def apply_deltas(repo: Repository, deltas: List[dict]) -> Optional[bool]:
+    # Transactions are begun by hand, so that they take the write lock upfront
+    engine = db.create_engine(
+        f"sqlite:///{get_remote_db_path(repo)}",
+        isolation_level="AUTOCOMMIT",
+        connect_args={"timeout": LARCH_CONFIG["lock_timeout"]},
+    )
+    metadata = db.MetaData()
+
+    try:
+        with engine.connect() as conn:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+            try:
+                # Another process may have applied some of them since the
+                # sequence number was read
+                seq = conn.execute(
+                    text("SELECT value FROM db_meta WHERE key = 'seq'")
+                ).scalar()
+
+                if seq is None or int(seq) < deltas[0]["seq"] - 1:
+                    conn.exec_driver_sql("ROLLBACK")
+                    return None
+
+                deltas = [delta for delta in deltas if delta["seq"] > int(seq)]
+
+                if not deltas:
+                    conn.exec_driver_sql("ROLLBACK")
+                    return False
+
+                for delta in deltas:
+                    for table_name in DELTA_TABLES:
+                        changes = delta.get(table_name, {})
+                        table = db.Table(table_name, metadata, autoload_with=conn)
+
+                        if changes.get("removed"):
+                            conn.execute(
+                                delete(table).where(table.c.id.in_(changes["removed"]))
+                            )
+
+                        new_rows = [
+                            *changes.get("added", []),
+                            *changes.get("changed", []),
+                        ]
+
+                        if "ver_key" in table.c:
+                            new_rows = [
+                                {"ver_key": Version(row["ver"]).db_key, **row}
+                                for row in new_rows
+                            ]
+
+                        # Rows that are already there are replaced
+                        if new_rows:
+                            conn.execute(
+                                insert(table).prefix_with("OR REPLACE"), new_rows
+                            )
+
+                conn.execute(
+                    text("UPDATE db_meta SET value = :seq WHERE key = 'seq'"),
+                    {"seq": str(deltas[-1]["seq"])},
+                )
+                conn.exec_driver_sql("COMMIT")
+            except BaseException:
+                conn.exec_driver_sql("ROLLBACK")
+                raise
+    finally:
+        engine.dispose()
+
+    return True
+
+
+def update_by_deltas(repo: Repository) -> Optional[bool]:
+    local_seq = get_local_seq(repo)
+
+    if local_seq is None:
+        return None
+
+    remote_seq = get_remote_seq(repo)
+
+    if remote_seq is None:
+        return None
+
+    if remote_seq <= local_seq:
+        return False
+
+    if remote_seq - local_seq > LARCH_CONFIG["delta_max_gap"]:
+        print(
+            Fore.YELLOW
+            + f"[{repo.name}] remote.db is {remote_seq - local_seq} change sets behind, fetching it in full"
+        )
+        return None
+
+    print(f"[{repo.name}] Fetching {remote_seq - local_seq} change set(s)...")
+
+    with ThreadPoolExecutor(max_workers=LARCH_CONFIG["fetch_workers"]) as executor:
+        deltas = list(
+            executor.map(
+                lambda seq: fetch_delta(repo, seq), range(local_seq + 1, remote_seq + 1)
+            )
+        )
+
+    if None in deltas:
+        print(
+            Fore.YELLOW
+            + f"[{repo.name}] Some change sets are missing, fetching remote.db in full"
+        )
+        return None
+
+    is_updated = apply_deltas(repo, deltas)
+
+    if is_updated is None:
+        print(
+            Fore.YELLOW
+            + f"[{repo.name}] remote.db has changed meanwhile, fetching it in full"
+        )
+
+    return is_updated
+
+
+def update_repo(repo: Repository, is_forced=False) -> bool:
+    try:
+        is_updated = None if is_forced else update_by_deltas(repo)
+    except SQLAlchemyError as e:
+        print(
+            Fore.YELLOW
+            + f"[{repo.name}] Could not apply change sets ({e}), fetching remote.db in full"
+        )
+        # The validators belong to the broken copy, they must not keep it
+        is_forced = True
+        is_updated = None
+
+    if is_updated is None:
+        is_updated = fetch_remote_db(repo, is_forced)
+
+    if is_updated:
+        refresh_search_index(repo)
+        print(Fore.GREEN + f"[{repo.name}] Updated")
+    else:
+        print(Fore.YELLOW + f"[{repo.name}] remote.db is already up-to-date")
+
+    return is_updated
+
+
+def update_pkg_meta(is_forced=False, repos: Optional[List[Repository]] = None):
     set_print_indentation_lvl(0)
 
     if is_forced:
@@ -36,30 +333,37 @@ def update_pkg_meta(is_forced=False):
 
     set_print_indentation_lvl(1)
 
-    remote_timestamp = get_remote_timestamp()
-    local_timestamp = datetime.min
+    repos = repos or LARCH_REPOS
+    failed = []
 
-    if os.path.isfile(LARCH_DIR / ".remote-db-timestamp"):
-        local_timestamp = parser.parse(
-            Path(LARCH_DIR / ".remote-db-timestamp").read_text()
-        )
-
-    if (
-        os.path.isfile(LARCH_DIR / ".remote-db-timestamp")
-        and os.path.isfile(LARCH_DIR / "remote.db")
-        and remote_timestamp <= local_timestamp
-        and not is_forced
-    ):
-        print(Fore.YELLOW + "remote.db is already up-to-date, stopping")
-    else:
-        fetch_remote_db()
+    # Repositories do not depend on each other, one slow or broken mirror
+    # does not hold the rest back
+    with ThreadPoolExecutor(max_workers=LARCH_CONFIG["fetch_workers"]) as executor:
+        futures = {
+            executor.submit(update_repo, repo, is_forced): repo for repo in repos
+        }
 
-        print("Updating local remote.db timestamp...", end=" ")
-        with open(LARCH_DIR / ".remote-db-timestamp", "w", encoding="utf8") as f:
-            f.write(str(remote_timestamp))
-            f.write("\n")
-        print(Fore.GREEN + "OK", no_indentation=True)
+        for future, repo in futures.items():
+            try:
+                future.result()
+            except (
+                requests.RequestException,
+                OSError,
+                ValueError,
+                SQLAlchemyError,
+            ) as e:
+                print(Fore.RED + f"[{repo.name}] Update failed: {e}")
+                failed.append(repo.name)
 
+    if failed:
+        print(
+            Fore.RED
+            + "The following repositories could not be updated: "
+            + "; ".join(failed)
+        )
+        set_print_indentation_lvl(0)
+        sys.exit(1)
+    else:
         print(Fore.GREEN + "Update procedure has been completed successfully.")
 
     set_print_indentation_lvl(0)
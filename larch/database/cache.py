@@ -0,0 +1,272 @@
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import sqlalchemy as db
+from sqlalchemy import Column, Float, Integer, String, Table, delete, func, select
+
+from larch import LARCH_CACHE, LARCH_CONFIG, LARCH_DIR
+from larch.lock import LockTimeout, file_lock, remove_lock_file
+
+LARCH_CACHE_DB = Path(LARCH_DIR) / "cache.db"
+
+cache_db_engine = db.create_engine(
+    f"sqlite:///{LARCH_CACHE_DB}", connect_args={"timeout": 30}
+)
+
+metadata = db.MetaData()
+
+CacheEntry = Table(
+    "entries",
+    metadata,
+    Column("key", String, primary_key=True),
+    Column("url", String, nullable=False),
+    Column("size", Integer, nullable=False),
+    Column("created_at", Float, nullable=False),
+    Column("accessed_at", Float, nullable=False, index=True),
+    Column("hits", Integer, nullable=False, default=0),
+)
+
+CacheStats = Table(
+    "stats",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("hits", Integer, nullable=False, default=0),
+    Column("misses", Integer, nullable=False, default=0),
+)
+
+cache_db_ready = False
+cache_db_lock = threading.Lock()
+
+
+def get_cache_db_engine():
+    global cache_db_ready
+
+    with cache_db_lock:
+        if not cache_db_ready:
+            # Other larch processes may be setting up the same file right now
+            with file_lock(
+                Path(LARCH_DIR) / "cache.db.lock", LARCH_CONFIG["lock_timeout"]
+            ):
+                metadata.create_all(cache_db_engine)
+
+                with cache_db_engine.begin() as conn:
+                    if conn.execute(select(CacheStats)).first() is None:
+                        conn.execute(CacheStats.insert().values(id=1, hits=0, misses=0))
+
+            cache_db_ready = True
+
+    return cache_db_engine
+
+
+def get_cache_max_size() -> Optional[int]:
+    max_size_mb = LARCH_CONFIG["cache_max_size_mb"]
+
+    if max_size_mb is None:
+        return None
+
+    return int(max_size_mb * 1024**2)
+
+
+# Held shared while an entry is placed somewhere, exclusively while it is
+# downloaded or removed
+def cache_entry_lock(key: str, shared=False, timeout: Optional[float] = None):
+    return file_lock(
+        Path(LARCH_CACHE / f"{key}.lock"),
+        LARCH_CONFIG["lock_timeout"] if timeout is None else timeout,
+        shared=shared,
+    )
+
+
+def cache_contains(key: str) -> bool:
+    with get_cache_db_engine().connect() as conn:
+        entry = conn.execute(
+            select(CacheEntry.c.key).where(CacheEntry.c.key == key)
+        ).first()
+
+    return entry is not None and Path(LARCH_CACHE / key).is_file()
+
+
+def cache_lookup(key: str) -> Optional[Path]:
+    cache_file = Path(LARCH_CACHE / key)
+    now = time.time()
+
+    with get_cache_db_engine().begin() as conn:
+        entry = conn.execute(
+            select(CacheEntry).where(CacheEntry.c.key == key)
+        ).one_or_none()
+
+        if entry is not None and not cache_file.is_file():
+            conn.execute(delete(CacheEntry).where(CacheEntry.c.key == key))
+            entry = None
+
+        if entry is None:
+            conn.execute(
+                CacheStats.update()
+                .where(CacheStats.c.id == 1)
+                .values(misses=CacheStats.c.misses + 1)
+            )
+            return None
+
+        conn.execute(
+            CacheEntry.update()
+            .where(CacheEntry.c.key == key)
+            .values(accessed_at=now, hits=CacheEntry.c.hits + 1)
+        )
+        conn.execute(
+            CacheStats.update()
+            .where(CacheStats.c.id == 1)
+            .values(hits=CacheStats.c.hits + 1)
+        )
+
+    return cache_file
+
+
+def cache_register(key: str, url: str):
+    size = Path(LARCH_CACHE / key).stat().st_size
+    now = time.time()
+
+    with get_cache_db_engine().begin() as conn:
+        conn.execute(delete(CacheEntry).where(CacheEntry.c.key == key))
+        conn.execute(
+            CacheEntry.insert().values(
+                key=key,
+                url=url,
+                size=size,
+                created_at=now,
+                accessed_at=now,
+                hits=0,
+            )
+        )
+
+
+def _remove_entries(conn, entries) -> Tuple[int, int]:
+    removed_count = 0
+    removed_size = 0
+
+    for entry in entries:
+        try:
+            # Entries being downloaded or placed right now are left alone
+            with cache_entry_lock(entry.key, timeout=0):
+                Path(LARCH_CACHE / entry.key).unlink(missing_ok=True)
+                remove_lock_file(LARCH_CACHE / f"{entry.key}.lock")
+        except LockTimeout:
+            continue
+
+        conn.execute(delete(CacheEntry).where(CacheEntry.c.key == entry.key))
+
+        removed_count += 1
+        removed_size += entry.size
+
+    return removed_count, removed_size
+
+
+def cache_evict(max_size: Optional[int] = None) -> Tuple[int, int]:
+    if max_size is None:
+        max_size = get_cache_max_size()
+
+    if max_size is None:
+        return 0, 0
+
+    with get_cache_db_engine().begin() as conn:
+        total_size = conn.execute(
+            select(func.coalesce(func.sum(CacheEntry.c.size), 0))
+        ).scalar()
+
+        if total_size <= max_size:
+            return 0, 0
+
+        victims = []
+
+        for entry in conn.execute(
+            select(CacheEntry.c.key, CacheEntry.c.size).order_by(
+                CacheEntry.c.accessed_at
+            )
+        ):
+            if total_size <= max_size:
+                break
+
+            victims.append(entry)
+            total_size -= entry.size
+
+        return _remove_entries(conn, victims)
+
+
+def cache_prune(
+    max_size: Optional[int] = None, older_than: Optional[float] = None
+) -> Tuple[int, int]:
+    removed_count, removed_size = 0, 0
+
+    if older_than is not None:
+        with get_cache_db_engine().begin() as conn:
+            removed_count, removed_size = _remove_entries(
+                conn,
+                list(
+                    conn.execute(
+                        select(CacheEntry.c.key, CacheEntry.c.size).where(
+                            CacheEntry.c.accessed_at < time.time() - older_than
+                        )
+                    )
+                ),
+            )
+
+        # Abandoned partial downloads are not indexed, find them by their suffix
+        for part_file in LARCH_CACHE.glob("*.part*"):
+            part_stat = part_file.stat()
+
+            if part_stat.st_mtime < time.time() - older_than:
+                part_file.unlink(missing_ok=True)
+                removed_size += part_stat.st_size
+
+    if max_size is not None:
+        evicted_count, evicted_size = cache_evict(max_size)
+        removed_count += evicted_count
+        removed_size += evicted_size
+
+    return removed_count, removed_size
+
+
+def cache_clear() -> Tuple[int, int]:
+    with get_cache_db_engine().begin() as conn:
+        removed_count, removed_size = _remove_entries(
+            conn, list(conn.execute(select(CacheEntry.c.key, CacheEntry.c.size)))
+        )
+        conn.execute(
+            CacheStats.update().where(CacheStats.c.id == 1).values(hits=0, misses=0)
+        )
+
+    # Partial downloads and files that never got indexed are left, every file
+    # name starts with the key of its entry
+    for key in {path.name.split(".")[0] for path in LARCH_CACHE.iterdir()}:
+        try:
+            with cache_entry_lock(key, timeout=0):
+                for path in LARCH_CACHE.glob(f"{key}.*"):
+                    if path.name != f"{key}.lock" and path.is_file():
+                        removed_size += path.stat().st_size
+                        path.unlink()
+
+                Path(LARCH_CACHE / key).unlink(missing_ok=True)
+                remove_lock_file(LARCH_CACHE / f"{key}.lock")
+        except LockTimeout:
+            continue
+
+    return removed_count, removed_size
+
+
+def get_cache_stats():
+    with get_cache_db_engine().connect() as conn:
+        stats = conn.execute(select(CacheStats)).one()
+        entries = conn.execute(
+            select(
+                func.count(CacheEntry.c.key),
+                func.coalesce(func.sum(CacheEntry.c.size), 0),
+            )
+        ).one()
+
+    return {
+        "entries": entries[0],
+        "size": entries[1],
+        "hits": stats.hits,
+        "misses": stats.misses,
+    }
@@ -1,13 +1,18 @@
-import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional
 
-from sqlalchemy import select
-
-from larch import LARCH_PROG_DIR, LARCH_REPO, LARCH_TEMP
-from larch.database.local import LocalPackage, local_db_conn
+from larch import LARCH_CONFIG, LARCH_PROG_DIR
+from larch.database.local import (
+    InstalledPackage,
+    get_installed_graph,
+    local_db_conn,
+    register_seed_meta,
+)
 from larch.database.remote import get_remote_candidate
-from larch.utils import progress_fetch, str_to_version_tuple
+from larch.dep_tree.constraint import Constraints, version_satisfies
+from larch.sandbox.safe_exec import safe_exec_seed
+from larch.session import http_get
 
 
 class FoundSeed:
@@ -17,81 +22,76 @@ class FoundSeed:
 
     seed_code = ""
     seed_type = None
+    dependencies = None
 
-    def __init__(self, seed_code, seed_type) -> None:
+    def __init__(self, seed_code, seed_type, dependencies=None) -> None:
         self.seed_code = seed_code
         self.seed_type = seed_type
+        self.dependencies = dependencies
+
+
+def get_installed_package(pkg_name: str) -> Optional[InstalledPackage]:
+    installed_pkg = get_installed_graph().get(pkg_name, None)
+
+    if installed_pkg is not None and installed_pkg.has_uninstall is None:
+        # Installed before seed metadata was stored in local.db, index it once
+        loc = safe_exec_seed(Path(LARCH_PROG_DIR, pkg_name, "larchseed.py").read_text())
+        register_seed_meta(pkg_name, loc)
+        local_db_conn.commit()
+
+        installed_pkg = get_installed_graph()[pkg_name]
+
+    return installed_pkg
 
 
 def find_seed_in_installed(
-    pkg_name: str, pkg_comp_str: Optional[str], pkg_ver: Optional[tuple]
+    pkg_name: str, constraints: Constraints = ()
 ) -> Optional[FoundSeed]:
-    local_packages = list(
-        local_db_conn.execute(
-            select(LocalPackage).where(LocalPackage.c.name == pkg_name)
-        )
-    )
-    local_packages.sort(key=lambda x: str_to_version_tuple(x.version))
-
-    if pkg_comp_str and pkg_ver:
-        comp_func = {
-            "==": pkg_ver.__eq__,
-            ">=": pkg_ver.__ge__,
-            "<=": pkg_ver.__le__,
-            ">": pkg_ver.__gt__,
-            "<": pkg_ver.__lt__,
-            "!=": pkg_ver.__ne__,
-        }[pkg_comp_str]
-
-        if pkg_comp_str and pkg_ver:
-            local_packages = list(
-                filter(
-                    lambda pkg: comp_func(str_to_version_tuple(pkg.version)),
-                    local_packages,
-                )
-            )
-
-    if len(local_packages) == 0:
+    installed_pkg = get_installed_package(pkg_name)
+
+    if installed_pkg is None:
         return None
-    else:
-        return FoundSeed(
-            seed_code=Path(LARCH_PROG_DIR, pkg_name, "larchseed.py").read_text(),
-            seed_type=FoundSeed.FoundSeedType.INSTALLED,
-        )
 
+    if not version_satisfies(installed_pkg.version, constraints):
+        return None
 
-def find_seed(
-    pkg_name: str, pkg_comp_str: Optional[str], pkg_ver: Optional[tuple]
-) -> Optional[FoundSeed]:
+    # The seed itself is only read when an install or uninstall hook needs it
+    return FoundSeed(
+        seed_code=None,
+        seed_type=FoundSeed.FoundSeedType.INSTALLED,
+        dependencies=installed_pkg.dependencies,
+    )
+
+
+def fetch_remote_seed(remote_pkg) -> str:
+    r = http_get(
+        remote_pkg.repo.url
+        + f"packages/{remote_pkg.name}/{remote_pkg.ver}/{remote_pkg.arch}/larchseed.py"
+    )
+    r.raise_for_status()
+
+    return r.content.decode("utf8")
+
+
+def fetch_remote_seeds(remote_pkgs: list) -> dict:
+    with ThreadPoolExecutor(max_workers=LARCH_CONFIG["fetch_workers"]) as executor:
+        return dict(zip(remote_pkgs, executor.map(fetch_remote_seed, remote_pkgs)))
+
+
+def find_seed(pkg_name: str, constraints: Constraints = ()) -> Optional[FoundSeed]:
     # region Find in installed
-    installed_seed = find_seed_in_installed(pkg_name, pkg_comp_str, pkg_ver)
+    installed_seed = find_seed_in_installed(pkg_name, constraints)
 
     if installed_seed:
         return installed_seed
     # endregion
 
     # region Find in remote
-    remote_pkg = get_remote_candidate(pkg_name, (pkg_comp_str, pkg_ver))
+    remote_pkg = get_remote_candidate(pkg_name, constraints)
 
     if remote_pkg:
-        seed_path = os.path.join(
-            LARCH_TEMP,
-            ".seeds",
-            remote_pkg.name,
-            remote_pkg.ver,
-            remote_pkg.arch,
-            "larchseed.py",
-        )
-        Path(os.path.dirname(seed_path)).mkdir(parents=True, exist_ok=True)
-
-        progress_fetch(
-            LARCH_REPO
-            + f"packages/{remote_pkg.name}/{remote_pkg.ver}/{remote_pkg.arch}/larchseed.py",
-            seed_path,
-        )
-
         return FoundSeed(
-            seed_code=Path(seed_path).read_text(),
+            seed_code=fetch_remote_seed(remote_pkg),
             seed_type=FoundSeed.FoundSeedType.REMOTE,
         )
     else:
@@ -1,13 +1,31 @@
+from collections import namedtuple
 from pathlib import Path
+from typing import Dict, Optional
 
 import sqlalchemy as db
-from sqlalchemy import Column, Integer, String, Table, Text, select, text
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Integer,
+    String,
+    Table,
+    Text,
+    delete,
+    insert,
+    select,
+    text,
+)
 
-from larch import LARCH_DIR
+from larch import LARCH_CONFIG, LARCH_DIR
 
 LARCH_INSTALLED_DB = Path(LARCH_DIR) / "local.db"
 
-local_db_engine = db.create_engine(f"sqlite:///{LARCH_INSTALLED_DB}")
+is_new_local_db = not LARCH_INSTALLED_DB.is_file()
+
+local_db_engine = db.create_engine(
+    f"sqlite:///{LARCH_INSTALLED_DB}",
+    connect_args={"timeout": LARCH_CONFIG["lock_timeout"]},
+)
 local_db_conn = local_db_engine.connect()
 
 metadata = db.MetaData()
@@ -26,9 +44,37 @@ LocalPackage = Table(
     Column("entry_point", String, nullable=True),
 )
 
-metadata.create_all(local_db_engine)
+LocalSeedMeta = Table(
+    "seed_meta",
+    metadata,
+    Column("name", String, primary_key=True),
+    Column("has_uninstall", Boolean, nullable=False),
+)
+
+LocalDependency = Table(
+    "dependencies",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String, nullable=False, index=True),
+    Column("requirement", String, nullable=False),
+)
 
-local_db_conn.execute(text("PRAGMA auto_vacuum = 1;"))
+InstalledPackage = namedtuple(
+    "InstalledPackage", ("name", "version", "dependencies", "has_uninstall")
+)
+
+installed_graph: Optional[Dict[str, InstalledPackage]] = None
+
+if is_new_local_db:
+    # Only takes effect before the first table is created
+    local_db_conn.execute(text("PRAGMA auto_vacuum = 1;"))
+
+# Readers work on a snapshot and never wait for an install, which keeps its
+# changes in a single transaction until it is done
+if local_db_conn.execute(text("PRAGMA journal_mode")).scalar() != "wal":
+    local_db_conn.execute(text("PRAGMA journal_mode = WAL"))
+
+metadata.create_all(local_db_conn)
 local_db_conn.commit()
 
 
@@ -50,3 +96,73 @@ def get_all_installed():
 
 def get_all_installed_pkg_str():
     return [r.name + "==" + r.version for r in get_all_installed()]
+
+
+def register_seed_meta(pkg_name: str, loc: dict):
+    global installed_graph
+
+    unregister_seed_meta(pkg_name)
+
+    local_db_conn.execute(
+        insert(LocalSeedMeta).values(
+            name=pkg_name, has_uninstall=callable(loc.get("uninstall", None))
+        )
+    )
+
+    dependencies = loc.get("DEPENDENCIES", None) or []
+
+    if dependencies:
+        local_db_conn.execute(
+            insert(LocalDependency),
+            [{"name": pkg_name, "requirement": dep} for dep in dependencies],
+        )
+
+    installed_graph = None
+
+
+def unregister_seed_meta(pkg_name: str):
+    global installed_graph
+
+    local_db_conn.execute(delete(LocalSeedMeta).where(LocalSeedMeta.c.name == pkg_name))
+    local_db_conn.execute(
+        delete(LocalDependency).where(LocalDependency.c.name == pkg_name)
+    )
+
+    installed_graph = None
+
+
+def get_installed_graph() -> Dict[str, InstalledPackage]:
+    global installed_graph
+
+    if installed_graph is not None:
+        return installed_graph
+
+    rows = local_db_conn.execute(
+        select(
+            LocalPackage.c.name,
+            LocalPackage.c.version,
+            LocalSeedMeta.c.has_uninstall,
+            LocalDependency.c.requirement,
+        )
+        .select_from(
+            LocalPackage.outerjoin(
+                LocalSeedMeta, LocalSeedMeta.c.name == LocalPackage.c.name
+            ).outerjoin(LocalDependency, LocalDependency.c.name == LocalPackage.c.name)
+        )
+        .order_by(LocalPackage.c.name, LocalDependency.c.id)
+    )
+
+    graph = {}
+
+    for row in rows:
+        if row.name not in graph:
+            graph[row.name] = InstalledPackage(
+                row.name, row.version, [], row.has_uninstall
+            )
+
+        if row.requirement is not None:
+            graph[row.name].dependencies.append(row.requirement)
+
+    installed_graph = graph
+
+    return installed_graph
@@ -1,24 +1,38 @@
-import platform
-from pathlib import Path
-from typing import Optional, Tuple
+import sys
+from collections import namedtuple
+from typing import Dict, Optional
 
 import sqlalchemy as db
 from colorama import Fore
-from sqlalchemy import Column, Integer, String, Table, or_, select
+from sqlalchemy import (
+    Column,
+    Index,
+    Integer,
+    String,
+    Table,
+    UniqueConstraint,
+    and_,
+    insert,
+    not_,
+    or_,
+    select,
+    text,
+)
 
-from larch import LARCH_DIR
+from larch import CURRENT_ARCH, LARCH_CONFIG, LARCH_REPOS, Repository
 from larch.commands.update import update_pkg_meta
+from larch.database.repos import get_pinned_repo, get_remote_db_path
+from larch.database.sparse import get_sparse_packages
+from larch.dep_tree.constraint import Constraints, version_satisfies
+from larch.dep_tree.version import Version
 from larch.utils import sp_print as print
-from larch.utils import str_to_version_tuple
 
-LARCH_REMOTE_DB = Path(LARCH_DIR) / "remote.db"
+RemoteCandidate = namedtuple("RemoteCandidate", ("name", "ver", "arch", "repo"))
 
-if not LARCH_REMOTE_DB.is_file():
-    print(Fore.YELLOW + "Missing remote.db, running larch.py update...")
-    update_pkg_meta()
+# Stored in 'PRAGMA user_version', older files are migrated on connect
+REMOTE_DB_SCHEMA_VERSION = 1
 
-remote_db_engine = db.create_engine(f"sqlite:///{LARCH_REMOTE_DB}")
-remote_db_conn = remote_db_engine.connect()
+remote_db_conns: Dict[str, db.Connection] = {}
 
 metadata = db.MetaData()
 
@@ -26,9 +40,12 @@ RemotePackage = Table(
     "packages",
     metadata,
     Column("id", Integer, primary_key=True),
-    Column("name", String, nullable=False, unique=True),
+    Column("name", String, nullable=False),
     Column("ver", String, nullable=False),
     Column("arch", String, nullable=False),
+    Column("ver_key", String, nullable=False),
+    UniqueConstraint("name", "ver", "arch"),
+    Index("ix_packages_name_arch_ver_key", "name", "arch", "ver_key"),
 )
 
 RemotePkgMeta = Table(
@@ -40,45 +57,175 @@ RemotePkgMeta = Table(
 )
 
 
-def remote_package_exists(pkg_name: str):
-    return remote_db_conn.scalars(
-        select(RemotePackage).where(RemotePackage.c.name == pkg_name).limit(1)
-    ).first()
+def migrate_remote_db(conn):
+    if conn.execute(text("PRAGMA user_version")).scalar() >= REMOTE_DB_SCHEMA_VERSION:
+        return
+
+    rows = []
+
+    if db.inspect(conn).has_table("packages"):
+        rows = [
+            {**row._mapping, "ver_key": Version(row.ver).db_key}
+            for row in conn.execute(text("SELECT id, name, ver, arch FROM packages"))
+        ]
+        conn.execute(text("DROP TABLE packages"))
+
+    metadata.create_all(conn)
+
+    if rows:
+        conn.execute(insert(RemotePackage), rows)
+
+    conn.execute(text(f"PRAGMA user_version = {REMOTE_DB_SCHEMA_VERSION}"))
+    conn.commit()
+
+
+def get_remote_db_conn(repo: Optional[Repository] = None):
+    repo = repo or LARCH_REPOS[0]
+
+    if repo.name not in remote_db_conns:
+        remote_db_path = get_remote_db_path(repo)
+        remote_db_engine = db.create_engine(f"sqlite:///{remote_db_path}")
+
+        if not remote_db_path.is_file():
+            if LARCH_CONFIG["index_protocol"] == "sparse":
+                # Catalog stays empty until 'larch update'
+                metadata.create_all(remote_db_engine)
+            else:
+                print(
+                    Fore.YELLOW
+                    + f"Missing remote.db of '{repo.name}', running larch.py update..."
+                )
+                update_pkg_meta(repos=[repo])
 
+                # Connecting would create an empty catalog in its place
+                if not remote_db_path.is_file():
+                    print(Fore.RED + f"Could not fetch the catalog of '{repo.name}'")
+                    sys.exit(1)
 
-def get_remote_candidate(pkg_name: str, desired_ver: Optional[Tuple[str, str]]):
-    def candidate_version_suits(candidate):
-        operation, desired_ver_tuple = desired_ver[0], str_to_version_tuple(
-            desired_ver[1]
+        remote_db_conn = remote_db_engine.connect()
+        migrate_remote_db(remote_db_conn)
+        remote_db_conns[repo.name] = remote_db_conn
+
+    return remote_db_conns[repo.name]
+
+
+def repo_has_package(repo: Repository, pkg_name: str) -> bool:
+    if LARCH_CONFIG["index_protocol"] == "sparse":
+        return len(get_sparse_packages(repo, pkg_name)) > 0
+
+    return (
+        get_remote_db_conn(repo)
+        .execute(
+            select(RemotePackage.c.id).where(RemotePackage.c.name == pkg_name).limit(1)
         )
-        candidate_ver = str_to_version_tuple(candidate.ver)
+        .first()
+        is not None
+    )
+
+
+# A package comes from the repository it is pinned to, otherwise from the first
+# repository that has it. Repositories of lower priority never mix their
+# versions in, so a public package cannot shadow an internal one
+def get_package_repo(pkg_name: str) -> Optional[Repository]:
+    pinned_repo = get_pinned_repo(pkg_name)
+
+    if pinned_repo is not None:
+        return pinned_repo if repo_has_package(pinned_repo, pkg_name) else None
+
+    return next(
+        (repo for repo in LARCH_REPOS if repo_has_package(repo, pkg_name)), None
+    )
+
 
-        compare_candidate_to = {
-            "==": candidate_ver.__eq__,
-            ">=": candidate_ver.__ge__,
-            "<=": candidate_ver.__le__,
-            ">": candidate_ver.__gt__,
-            "<": candidate_ver.__lt__,
-            "!=": candidate_ver.__ne__,
-        }[operation]
+def remote_package_exists(pkg_name: str) -> bool:
+    return get_package_repo(pkg_name) is not None
 
-        return compare_candidate_to(desired_ver_tuple)
 
-    current_arch = platform.system() + "_" + platform.architecture()[0]
+def _ver_key_starts_with(prefix: str):
+    ver_key = RemotePackage.c.ver_key
 
-    candidates = remote_db_conn.execute(
+    # Parts of a key are separated by " ", the next character is "!"
+    return or_(ver_key == prefix, and_(ver_key >= prefix + " ", ver_key < prefix + "!"))
+
+
+def constraint_to_sql(comparator: str, ver: str):
+    ver_key = RemotePackage.c.ver_key
+
+    if ver.endswith(".*"):
+        starts_with = _ver_key_starts_with(Version(ver[:-2]).db_key)
+
+        return starts_with if comparator == "==" else not_(starts_with)
+
+    desired_key = Version(ver).db_key
+
+    if comparator == "~=":
+        return and_(
+            ver_key >= desired_key,
+            _ver_key_starts_with(Version(ver.rsplit(".", 1)[0]).db_key),
+        )
+
+    return {
+        "==": ver_key == desired_key,
+        ">=": ver_key >= desired_key,
+        "<=": ver_key <= desired_key,
+        ">": ver_key > desired_key,
+        "<": ver_key < desired_key,
+        "!=": ver_key != desired_key,
+    }[comparator]
+
+
+def select_remote_versions(pkg_name: str, constraints: Constraints = ()):
+    # Newest version first, a build for this machine wins over an "any" one
+    return (
         select(RemotePackage)
         .where(RemotePackage.c.name == pkg_name)
-        .where(or_(RemotePackage.c.arch == current_arch, RemotePackage.c.arch == "any"))
+        .where(RemotePackage.c.arch.in_((CURRENT_ARCH, "any")))
+        .where(*(constraint_to_sql(*constraint) for constraint in constraints))
+        .order_by(RemotePackage.c.ver_key.desc(), RemotePackage.c.arch == "any")
     )
 
-    candidates = list(candidates)
-    candidates.sort(key=lambda x: str_to_version_tuple(x.ver))
 
-    if desired_ver is not None and desired_ver[0] and desired_ver[1]:
-        candidates = list(filter(candidate_version_suits, candidates))
+def get_remote_versions(pkg_name: str) -> list:
+    repo = get_package_repo(pkg_name)
+
+    if repo is None:
+        return []
+
+    if LARCH_CONFIG["index_protocol"] != "sparse":
+        return [
+            RemoteCandidate(row.name, row.ver, row.arch, repo)
+            for row in get_remote_db_conn(repo).execute(
+                select_remote_versions(pkg_name)
+            )
+        ]
+
+    candidates = [
+        pkg
+        for pkg in get_sparse_packages(repo, pkg_name)
+        if pkg.arch in (CURRENT_ARCH, "any")
+    ]
+    candidates.sort(key=lambda x: Version(x.ver).key, reverse=True)
+
+    return candidates
+
+
+def get_remote_candidate(pkg_name: str, constraints: Constraints = ()):
+    if LARCH_CONFIG["index_protocol"] == "sparse":
+        for candidate in get_remote_versions(pkg_name):
+            if version_satisfies(candidate.ver, constraints):
+                return candidate  # The newest suitable version
 
-    if candidates not in [None, [], ()]:
-        return candidates[0]
-    else:
         return None
+
+    repo = get_package_repo(pkg_name)
+
+    if repo is None:
+        return None
+
+    row = (
+        get_remote_db_conn(repo)
+        .execute(select_remote_versions(pkg_name, constraints).limit(1))
+        .first()
+    )
+
+    return None if row is None else RemoteCandidate(row.name, row.ver, row.arch, repo)
@@ -0,0 +1,96 @@
+import shutil
+import sys
+import threading
+from pathlib import Path
+from typing import Optional
+
+from colorama import Fore
+
+from larch import LARCH_CONFIG, LARCH_DIR, LARCH_REPOS, Repository
+from larch.lock import file_lock
+from larch.utils import sp_print as print
+
+LARCH_REPOS_DIR = Path(LARCH_DIR) / "repos"
+
+# Files kept directly in LARCH_DIR while there was a single repository
+LEGACY_REPO_FILES = ("remote.db", ".remote-db-validators", "sparse", "search.db")
+
+# The URL a repository folder was filled from
+REPO_URL_FILE = "url.txt"
+
+repo_dir_lock = threading.Lock()
+checked_repo_dirs = set()
+
+
+def read_repo_url(repo_dir: Path) -> Optional[str]:
+    try:
+        return (repo_dir / REPO_URL_FILE).read_text().strip()
+    except OSError:
+        return None
+
+
+def get_repo_dir(repo: Repository) -> Path:
+    repo_dir = LARCH_REPOS_DIR / repo.name
+
+    with repo_dir_lock:
+        if repo in checked_repo_dirs:
+            return repo_dir
+
+        LARCH_REPOS_DIR.mkdir(parents=True, exist_ok=True)
+
+        # Never let a bad name reach outside of the repositories folder, the
+        # folder may be removed below
+        if repo_dir.resolve().parent != LARCH_REPOS_DIR.resolve():
+            print(
+                Fore.RED
+                + f"Repository folder '{repo_dir}' is outside of '{LARCH_REPOS_DIR}'"
+            )
+            sys.exit(1)
+
+        with file_lock(LARCH_REPOS_DIR / ".lock"):
+            if not repo_dir.is_dir():
+                repo_dir.mkdir()
+
+                if repo == LARCH_REPOS[0]:
+                    for file_name in LEGACY_REPO_FILES:
+                        if Path(LARCH_DIR, file_name).exists():
+                            shutil.move(str(Path(LARCH_DIR, file_name)), str(repo_dir))
+
+                (repo_dir / REPO_URL_FILE).write_text(repo.url)
+            elif read_repo_url(repo_dir) != repo.url:
+                # The name points at another repository in repo.txt now, the
+                # catalog, sequence number and validators of the old one must
+                # not be mistaken for its
+                shutil.rmtree(repo_dir)
+                repo_dir.mkdir()
+                (repo_dir / REPO_URL_FILE).write_text(repo.url)
+
+        checked_repo_dirs.add(repo)
+
+    return repo_dir
+
+
+def get_remote_db_path(repo: Repository) -> Path:
+    return get_repo_dir(repo) / "remote.db"
+
+
+def get_repo_by_name(repo_name: str) -> Optional[Repository]:
+    return next((repo for repo in LARCH_REPOS if repo.name == repo_name), None)
+
+
+def get_pinned_repo(pkg_name: str) -> Optional[Repository]:
+    repo_name = LARCH_CONFIG["repo_pins"].get(pkg_name, None)
+
+    if repo_name is None:
+        return None
+
+    repo = get_repo_by_name(repo_name)
+
+    if repo is None:
+        print(
+            Fore.RED
+            + f"Package '{pkg_name}' is pinned to an unknown repository '{repo_name}'"
+        )
+        sys.exit(1)
+
+    return repo
@@ -0,0 +1,134 @@
+from typing import Dict, List, Optional
+
+import sqlalchemy as db
+from sqlalchemy import text
+
+from larch import Repository
+from larch.database.repos import get_remote_db_path, get_repo_dir
+
+search_db_engines: Dict[str, db.Engine] = {}
+
+
+def get_search_db_engine(repo: Repository) -> db.Engine:
+    if repo.name not in search_db_engines:
+        search_db_engines[repo.name] = db.create_engine(
+            f"sqlite:///{get_repo_dir(repo) / 'search.db'}"
+        )
+
+    return search_db_engines[repo.name]
+
+
+def create_search_index(conn):
+    # Rows share their rowid with the pkg_meta row they were built from
+    conn.execute(
+        text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS pkg_search "
+            "USING fts5(name, description, prefix = '2 3')"
+        )
+    )
+    conn.execute(
+        text(
+            "CREATE TABLE IF NOT EXISTS search_meta "
+            "(key VARCHAR PRIMARY KEY, value VARCHAR NOT NULL)"
+        )
+    )
+
+
+def get_remote_db_stamp(repo: Repository) -> Optional[str]:
+    try:
+        remote_db_stat = get_remote_db_path(repo).stat()
+    except FileNotFoundError:
+        return None
+
+    return f"{remote_db_stat.st_mtime_ns}:{remote_db_stat.st_size}"
+
+
+def refresh_search_index(repo: Repository):
+    stamp = get_remote_db_stamp(repo)
+
+    if stamp is None:
+        return
+
+    with get_search_db_engine(repo).connect() as conn:
+        # Has to happen outside of a transaction
+        conn.execute(
+            text("ATTACH DATABASE :path AS remote"),
+            {"path": str(get_remote_db_path(repo))},
+        )
+
+        try:
+            create_search_index(conn)
+
+            # Only the rows that were removed or changed since the last refresh
+            # are rewritten
+            conn.execute(
+                text(
+                    "DELETE FROM pkg_search WHERE rowid NOT IN "
+                    "(SELECT id FROM remote.pkg_meta) OR rowid IN "
+                    "(SELECT s.rowid FROM pkg_search AS s "
+                    "JOIN remote.pkg_meta AS m ON m.id = s.rowid "
+                    'WHERE m.name != s.name OR m."desc" != s.description)'
+                )
+            )
+            conn.execute(
+                text(
+                    "INSERT INTO pkg_search (rowid, name, description) "
+                    'SELECT id, name, "desc" FROM remote.pkg_meta '
+                    "WHERE id NOT IN (SELECT rowid FROM pkg_search)"
+                )
+            )
+            conn.execute(
+                text(
+                    "INSERT OR REPLACE INTO search_meta (key, value) "
+                    "VALUES ('remote_db', :stamp)"
+                ),
+                {"stamp": stamp},
+            )
+            conn.commit()
+        finally:
+            conn.rollback()
+            conn.execute(text("DETACH DATABASE remote"))
+
+
+def is_search_index_stale(repo: Repository) -> bool:
+    with get_search_db_engine(repo).begin() as conn:
+        create_search_index(conn)
+
+        indexed_stamp = conn.execute(
+            text("SELECT value FROM search_meta WHERE key = 'remote_db'")
+        ).scalar()
+
+    return indexed_stamp != get_remote_db_stamp(repo)
+
+
+def to_match_query(terms: List[str]) -> str:
+    # Every term is quoted, user input is never parsed as FTS5 syntax
+    return " ".join('"' + term.replace('"', '""') + '"*' for term in terms if term)
+
+
+def search_catalog(
+    repo: Repository, terms: List[str], limit: int, highlight=("", "")
+) -> list:
+    match_query = to_match_query(terms)
+
+    if not match_query:
+        return []
+
+    with get_search_db_engine(repo).connect() as conn:
+        return list(
+            conn.execute(
+                text(
+                    "SELECT name AS pkg_name, bm25(pkg_search, 10.0, 1.0) AS rank, "
+                    "highlight(pkg_search, 0, :start, :end) AS name, "
+                    "snippet(pkg_search, 1, :start, :end, '...', 16) AS snippet "
+                    "FROM pkg_search WHERE pkg_search MATCH :query "
+                    "ORDER BY rank LIMIT :limit"
+                ),
+                {
+                    "query": match_query,
+                    "limit": limit,
+                    "start": highlight[0],
+                    "end": highlight[1],
+                },
+            )
+        )
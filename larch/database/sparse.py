@@ -0,0 +1,96 @@
+import json
+import threading
+from collections import namedtuple
+from pathlib import Path
+from typing import List, Optional
+
+import requests
+
+from larch import Repository
+from larch.database.repos import get_repo_dir
+from larch.session import http_get
+
+SparsePackage = namedtuple("SparsePackage", ("name", "ver", "arch", "repo"))
+
+_sparse_indexes = {}
+_sparse_lock = threading.Lock()
+
+
+def _read_cached_index(cache_file: Path) -> Optional[dict]:
+    try:
+        return json.loads(cache_file.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def get_sparse_dir(repo: Repository) -> Path:
+    return get_repo_dir(repo) / "sparse"
+
+
+def fetch_sparse_index(repo: Repository, pkg_name: str) -> Optional[dict]:
+    cache_file = get_sparse_dir(repo) / f"{pkg_name}.json"
+    cached = _read_cached_index(cache_file)
+    headers = {}
+
+    if cached is not None:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    try:
+        r = http_get(repo.url + f"packages/{pkg_name}/index.json", headers=headers)
+    except requests.RequestException:
+        if cached is None:
+            raise
+
+        return cached["index"]  # Offline, the last known index is good enough
+
+    if r.status_code == 304:
+        return cached["index"]
+
+    if r.status_code == 404:
+        cache_file.unlink(missing_ok=True)
+        return None
+
+    r.raise_for_status()
+
+    index = r.json()
+
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    cache_file.write_text(
+        json.dumps(
+            {
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+                "index": index,
+            }
+        )
+    )
+
+    return index
+
+
+def get_sparse_index(repo: Repository, pkg_name: str) -> Optional[dict]:
+    with _sparse_lock:
+        if (repo, pkg_name) in _sparse_indexes:
+            return _sparse_indexes[(repo, pkg_name)]
+
+    index = fetch_sparse_index(repo, pkg_name)
+
+    with _sparse_lock:
+        _sparse_indexes[(repo, pkg_name)] = index
+
+    return index
+
+
+def get_sparse_packages(repo: Repository, pkg_name: str) -> List[SparsePackage]:
+    index = get_sparse_index(repo, pkg_name)
+
+    if index is None:
+        return []
+
+    return [
+        SparsePackage(pkg_name, version["ver"], version["arch"], repo)
+        for version in index.get("versions", [])
+    ]
@@ -0,0 +1,115 @@
+import operator
+import re
+import sys
+from collections import namedtuple
+from functools import lru_cache, partial
+from typing import Callable, List, Tuple
+
+from colorama import Fore
+
+from larch.dep_tree.version import Version
+
+Requirement = namedtuple("Requirement", ("pkg_str", "name", "constraints"))
+
+Constraints = Tuple[Tuple[str, str], ...]
+
+COMPARATORS = "~=|>=|==|!=|<=|<|>"
+
+name_re = re.compile(rf"({COMPARATORS}).*")
+constraint_re = re.compile(rf"({COMPARATORS})?([^<>=!~,]+)")
+
+
+def is_valid_constraint(comparator: str, ver: str) -> bool:
+    if ver.endswith(".*"):
+        # Wildcards only make sense for (in)equality: ==1.2.*, !=1.*
+        return comparator in ("==", "!=") and "*" not in ver[:-2]
+
+    if "*" in ver:
+        return False
+
+    # ~=1.4 means >=1.4,==1.*, so there has to be a part to keep
+    return comparator != "~=" or "." in ver
+
+
+@lru_cache(maxsize=4096)
+def parse_requirement(pkg_str: str) -> Requirement:
+    pkg_str = re.sub(r"\s*", "", pkg_str)
+
+    name = name_re.sub("", pkg_str)
+    constraints = []
+
+    spec_start = len(name)
+    spec = pkg_str[spec_start:]
+
+    for part in spec.split(",") if spec else []:
+        constraint = constraint_re.fullmatch(part)
+
+        if constraint is None or not is_valid_constraint(
+            constraint.group(1) or "==", constraint.group(2)
+        ):
+            print(Fore.RED + f"Wrong version format: '{pkg_str}', stopping")
+            sys.exit(1)
+
+        constraints.append((constraint.group(1) or "==", constraint.group(2)))
+
+    return Requirement(pkg_str, name, tuple(constraints))
+
+
+def format_constraints(constraints: Constraints) -> str:
+    return ",".join(comparator + ver for comparator, ver in constraints)
+
+
+# Constraints are compiled into checks over precomputed version keys, so that
+# filtering does not build any objects per candidate
+def _starts_with(prefix: Version) -> Callable[[tuple], bool]:
+    prefix_len = len(prefix.key)
+
+    return lambda key: key[:prefix_len] == prefix.key
+
+
+def _compile_constraint(comparator: str, ver: str) -> Callable[[tuple], bool]:
+    if ver.endswith(".*"):
+        starts_with = _starts_with(Version(ver[:-2]))
+
+        if comparator == "==":
+            return starts_with
+
+        return lambda key: not starts_with(key)
+
+    desired_key = Version(ver).key
+
+    if comparator == "~=":
+        starts_with = _starts_with(Version(ver.rsplit(".", 1)[0]))
+
+        return lambda key: key >= desired_key and starts_with(key)
+
+    # The candidate key is passed as the second argument
+    return partial(
+        {
+            "==": operator.eq,
+            ">=": operator.le,
+            "<=": operator.ge,
+            ">": operator.lt,
+            "<": operator.gt,
+            "!=": operator.ne,
+        }[comparator],
+        desired_key,
+    )
+
+
+@lru_cache(maxsize=4096)
+def compile_constraints(constraints: Constraints) -> List[Callable[[tuple], bool]]:
+    return [_compile_constraint(comparator, ver) for comparator, ver in constraints]
+
+
+def version_satisfies(ver, constraints: Constraints) -> bool:
+    if not constraints:
+        return True
+
+    key = Version(ver).key
+
+    for check in compile_constraints(constraints):
+        if not check(key):
+            return False
+
+    return True
@@ -1,11 +1,16 @@
-import re
 import sys
-from typing import List
+from typing import Dict, List, Tuple
 
 from colorama import Fore
 
 from larch.database.find_seed import find_seed
-from larch.database.local import get_all_installed_pkg_str
+from larch.database.local import get_installed_graph
+from larch.dep_tree.constraint import (
+    Constraints,
+    format_constraints,
+    parse_requirement,
+    version_satisfies,
+)
 from larch.sandbox.safe_exec import safe_exec_seed
 
 
@@ -15,96 +20,153 @@ class Node:
         REMOTE = 1
         UNINSTALLING = 2
 
-    parents = []
-    children = []
-
-    all_nodes = []
-    node_type: NodeType = None
+    __slots__ = (
+        "pkg_str",
+        "name",
+        "constraints",
+        "parents",
+        "children",
+        "node_type",
+        "seed_code",
+    )
+
+    all_nodes: List["Node"] = []
+    index: Dict[str, "Node"] = {}
+    resolved: Dict[Tuple[str, Constraints], "Node"] = {}
+    resolving: List[str] = []
+
+    def __init__(self, pkg_str: str):
+        self.pkg_str, self.name, self.constraints = parse_requirement(pkg_str)
+
+        self.parents: List[Node] = []
+        self.children: List[Node] = []
+        self.node_type = None
+        self.seed_code = None
 
-    name = ""
-    ver = ""
+        Node.all_nodes.append(self)
+        Node.index.setdefault(self.name, self)
 
-    def __init__(self, parents, children, pkg_str):
-        self.parents = parents
-        self.children = children
+    def __str__(self):
+        ver = format_constraints(self.constraints) or None
 
-        pkg_str = re.sub(r"\s*", "", pkg_str)
-        self.pkg_str = pkg_str
+        parents = [parent.name for parent in self.parents]
 
-        # region Parse version
-        self.name = re.sub(r"(>=|==|!=|<=|<|>).*", "", pkg_str).strip()
+        return f"Node(name = '{self.name}', version = '{ver}', type = {self.node_type}, parents = {parents})"
 
-        pkg_ver = re.search(r"(>=|==|!=|<=|<|>)(.*)", pkg_str)
-        if pkg_ver:
-            pkg_ver = (pkg_ver.group(1), pkg_ver.group(2).strip())
+    def __repr__(self) -> str:
+        return self.__str__()
 
-        if type(pkg_ver) in (list, tuple):
-            if not pkg_ver[0] or not pkg_ver[1]:
-                print(Fore.RED + f"Wrong version format: '{pkg_str}', stopping")
-                sys.exit(1)
+    def add_child(self, child: "Node"):
+        self.children.append(child)
+        child.parents.append(self)
 
-        self.ver = pkg_ver[1] if pkg_ver else None
-        self.comparator = pkg_ver[0] if (pkg_ver and pkg_ver[0]) else None
+    def expand(self):
+        seed_instance = find_seed(self.name, self.constraints)
 
-        if self.ver and not self.comparator:
-            self.comparator = "=="
-        # endregion
+        if seed_instance is None:
+            ver_info = format_constraints(self.constraints)
 
-        # region Get children
-        deps = None
+            print(
+                Fore.RED
+                + f"The following package does not exist: '{self.name}{ver_info}'. Stopping"
+            )
 
-        if self.name not in ("@user", "@local"):
-            seed_instance = find_seed(self.name, self.comparator, self.ver)
+            sys.exit(1)
 
-            if seed_instance is None:
-                ver_info = ""
+        self.seed_code = seed_instance.seed_code
 
-                if self.comparator and self.ver:
-                    ver_info = self.comparator + self.ver
+        self.node_type = (
+            Node.NodeType.INSTALLED
+            if seed_instance.seed_type == seed_instance.FoundSeedType.INSTALLED
+            else Node.NodeType.REMOTE
+        )
 
-                print(
-                    Fore.RED
-                    + f"The following package does not exist: '{self.name}{ver_info}'. Stopping"
-                )
+        if seed_instance.dependencies is not None:
+            deps = seed_instance.dependencies
+        else:
+            loc = safe_exec_seed(self.seed_code)
+            deps = loc.get("DEPENDENCIES", None)
 
-                sys.exit(1)
+        Node.resolving.append(self.name)
 
-            self.seed_code = seed_instance.seed_code
+        try:
+            for dep in deps or []:
+                self.add_child(Node.require(dep))
+        finally:
+            Node.resolving.pop()
 
-            self.node_type = (
-                Node.NodeType.INSTALLED
-                if seed_instance.seed_type == seed_instance.FoundSeedType.INSTALLED
-                else Node.NodeType.REMOTE
+    @staticmethod
+    def require(pkg_str: str) -> "Node":
+        pkg_str, name, constraints = parse_requirement(pkg_str)
+
+        if name in Node.resolving:
+            cycle_start = Node.resolving.index(name)
+            cycle = [*Node.resolving[cycle_start:], name]
+            print(
+                Fore.RED + f"Dependency cycle detected: {' -> '.join(cycle)}. Stopping"
             )
+            sys.exit(1)
 
-            loc = safe_exec_seed(self.seed_code)
-            deps = loc.get("DEPENDENCIES", None)
+        # Every (name, constraint) pair is resolved and expanded only once,
+        # diamond dependencies share the node
+        node = Node.resolved.get((name, constraints), None)
 
-        for child in self.children:
-            child.parents.append(self)
+        if node is None:
+            node = Node(pkg_str)
+            Node.resolved[(name, constraints)] = node
+            node.expand()
 
-        if deps:
-            for dep in deps:
-                self.children.append(Node([self], [], dep))
-        # endregion
+        return node
 
-        Node.all_nodes.append(self)
+    @staticmethod
+    def create_root(name: str, pkg_strs: List[str]) -> "Node":
+        root = Node(name)
 
-    def __str__(self):
-        if not self.ver:
-            ver = None
-        else:
-            ver = f"{self.comparator}{self.ver}"
+        for pkg_str in pkg_strs:
+            root.add_child(Node.require(pkg_str))
 
-        return f"Node(name = '{self.name}', version = '{ver}', type = {self.node_type}, parents = {self.parents})"
+        return root
 
-    def __repr__(self) -> str:
-        return self.__str__()
+    @staticmethod
+    def from_solution(
+        name: str, pkg_strs: List[str], solution: dict, provider
+    ) -> "Node":
+        nodes: Dict[str, Node] = {}
+
+        for pkg_name, candidate in solution.items():
+            node = Node(f"{pkg_name}=={candidate.ver}")
+            node.node_type = (
+                Node.NodeType.INSTALLED if candidate.installed else Node.NodeType.REMOTE
+            )
+            node.seed_code = provider.get_seed_code(candidate)
+            nodes[pkg_name] = node
+
+        for pkg_name, candidate in solution.items():
+            for dep in provider.get_dependencies(candidate):
+                nodes[pkg_name].add_child(nodes[parse_requirement(dep).name])
+
+        root = Node(name)
+
+        for pkg_str in pkg_strs:
+            root.add_child(nodes[parse_requirement(pkg_str).name])
+
+        return root
 
     @staticmethod
     def reset():
         Node.all_nodes = []
+        Node.index = {}
+        Node.resolved = {}
+        Node.resolving = []
 
+    @staticmethod
+    def load_local():
+        return Node.create_root(
+            "@local",
+            [f"{pkg.name}=={pkg.version}" for pkg in get_installed_graph().values()],
+        )
+
+    @staticmethod
     def shake_tree():
         def merge_nodes(nodes: List[Node]) -> Node:
             if len(nodes) == 1:
@@ -116,23 +178,46 @@ class Node:
             merged_node = nodes[0]
 
             for node in nodes[1:]:
-                merged_node.parents = [*merged_node.parents, *node.parents]
-
                 if set([Node.NodeType.INSTALLED, Node.NodeType.REMOTE]) == set(
                     [merged_node.node_type, node.node_type]
                 ):
                     merged_node.node_type = Node.NodeType.INSTALLED
 
-                if node.ver and not merged_node.ver:
-                    merged_node.ver = node.ver
-                    merged_node.comparator = "=="
+                merged_node.constraints += tuple(
+                    constraint
+                    for constraint in node.constraints
+                    if constraint not in merged_node.constraints
+                )
+
+                for parent in node.parents:
+                    parent.children = [
+                        merged_node if child is node else child
+                        for child in parent.children
+                    ]
 
-                if node.ver and merged_node.ver and node.ver != merged_node.ver:
-                    raise Exception(
-                        "Unresolved dependency conflict: "
-                        + f"{node.name}{node.comparator}{node.ver} and "
-                        + f"{merged_node.name}{merged_node.comparator}{merged_node.ver}"
-                    )  # TODO
+                    if parent not in merged_node.parents:
+                        merged_node.parents.append(parent)
+
+                for child in node.children:
+                    child.parents = [
+                        merged_node if parent is node else parent
+                        for parent in child.parents
+                    ]
+
+                    if child not in merged_node.children:
+                        merged_node.children.append(child)
+
+            installed_pkg = get_installed_graph().get(merged_node.name, None)
+
+            if installed_pkg is not None and not version_satisfies(
+                installed_pkg.version, merged_node.constraints
+            ):
+                print(
+                    Fore.RED
+                    + f"Unresolved dependency conflict: installed '{merged_node.name}=={installed_pkg.version}' "
+                    + f"does not satisfy '{merged_node.name}{format_constraints(merged_node.constraints)}'"
+                )
+                sys.exit(1)
 
             return merged_node
 
@@ -151,11 +236,11 @@ class Node:
         for _, nodes in package_str_to_nodes.items():
             new_node_list.append(merge_nodes(nodes))
 
+        for node in new_node_list:
+            node.parents = list(dict.fromkeys(node.parents))
+            node.children = list(dict.fromkeys(node.children))
+
         Node.all_nodes = new_node_list
+        Node.index = {node.name: node for node in new_node_list}
 
         return Node.all_nodes
-
-
-Node(
-    [], list(Node([], [], pkg_str) for pkg_str in get_all_installed_pkg_str()), "@local"
-)
@@ -0,0 +1,320 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from colorama import Fore
+
+from larch import LARCH_CONFIG
+from larch.database.find_seed import fetch_remote_seeds, get_installed_package
+from larch.database.remote import get_remote_versions
+from larch.dep_tree.constraint import (
+    Constraints,
+    format_constraints,
+    parse_requirement,
+    version_satisfies,
+)
+from larch.sandbox.safe_exec import safe_exec_seed
+from larch.utils import sp_print as print
+
+Candidate = namedtuple("Candidate", ("name", "ver", "arch", "repo", "installed"))
+
+
+class ResolutionError(Exception):
+    pass
+
+
+# Every seed is fetched and executed at most once per resolution
+class SeedProvider:
+    def __init__(self):
+        self.candidates: Dict[str, List[Candidate]] = {}
+        self.dependencies: Dict[Candidate, List[str]] = {}
+        self.seeds: Dict[Candidate, str] = {}
+
+    def get_candidates(self, pkg_name: str) -> List[Candidate]:
+        if pkg_name not in self.candidates:
+            installed_pkg = get_installed_package(pkg_name)
+
+            # Installed packages are never upgraded implicitly
+            if installed_pkg is not None:
+                self.candidates[pkg_name] = [
+                    Candidate(pkg_name, installed_pkg.version, None, None, True)
+                ]
+            else:
+                self.add_remote_versions(pkg_name, get_remote_versions(pkg_name))
+
+        return self.candidates[pkg_name]
+
+    def add_remote_versions(self, pkg_name: str, versions: list):
+        self.candidates[pkg_name] = [
+            Candidate(pkg.name, pkg.ver, pkg.arch, pkg.repo, False) for pkg in versions
+        ]
+
+    def prefetch_candidates(self, pkg_names: List[str]):
+        if LARCH_CONFIG["index_protocol"] != "sparse":
+            return
+
+        missing = [
+            pkg_name
+            for pkg_name in pkg_names
+            if pkg_name not in self.candidates
+            and get_installed_package(pkg_name) is None
+        ]
+
+        if len(missing) > 1:
+            with ThreadPoolExecutor(
+                max_workers=LARCH_CONFIG["fetch_workers"]
+            ) as executor:
+                for pkg_name, versions in zip(
+                    missing, executor.map(get_remote_versions, missing)
+                ):
+                    self.add_remote_versions(pkg_name, versions)
+
+    def prefetch_seeds(self, candidates: List[Candidate]):
+        missing = [
+            candidate
+            for candidate in dict.fromkeys(candidates)
+            if not candidate.installed and candidate not in self.seeds
+        ]
+
+        if not missing:
+            return
+
+        print(f"Fetching {len(missing)} seed(s)...", end=" ")
+        self.seeds.update(fetch_remote_seeds(missing))
+        print(Fore.GREEN + "OK", no_indentation=True)
+
+    def get_seed_code(self, candidate: Candidate) -> Optional[str]:
+        if candidate.installed:
+            return None
+
+        self.prefetch_seeds([candidate])
+
+        return self.seeds[candidate]
+
+    def get_dependencies(self, candidate: Candidate) -> List[str]:
+        if candidate not in self.dependencies:
+            if candidate.installed:
+                deps = get_installed_package(candidate.name).dependencies
+            else:
+                loc = safe_exec_seed(self.get_seed_code(candidate))
+                deps = loc.get("DEPENDENCIES", None) or []
+
+            self.dependencies[candidate] = list(deps)
+
+        return self.dependencies[candidate]
+
+
+# Constraints, who they are shown as coming from and the package whose
+# decision added them, if any
+RequirementEntry = Tuple[Constraints, str, Optional[str]]
+
+
+class _Frame:
+    __slots__ = ("name", "candidates", "added", "culprits")
+
+    def __init__(self, name: str, candidates: List[Candidate]):
+        self.name = name
+        self.candidates = candidates
+        self.added: List[str] = []
+        # Earlier decisions that ruled out the candidates tried so far
+        self.culprits: Set[str] = set()
+
+
+# Packages are decided one at a time, newest suitable version first. When a
+# package has no version left, the resolver jumps back to the latest decision
+# that took part in ruling its versions out and tries the next older version
+# there. Failures are remembered by the constraints on the package, so that a
+# dead end is not explored again under every version of its parents
+class Resolver:
+    def __init__(self, provider: SeedProvider):
+        self.provider = provider
+        self.requirements: Dict[str, List[RequirementEntry]] = {}
+        self.solution: Dict[str, Candidate] = {}
+        self.trail: List[_Frame] = []
+        self.failures: Dict[
+            Tuple[str, FrozenSet[Constraints]], Dict[str, Candidate]
+        ] = {}
+        self.conflict: Optional[str] = None
+
+    def add_requirement(
+        self, pkg_str: str, required_by: str, requirer: Optional[str] = None
+    ) -> str:
+        _, name, constraints = parse_requirement(pkg_str)
+        self.requirements.setdefault(name, []).append(
+            (constraints, required_by, requirer)
+        )
+
+        return name
+
+    def explain(self, name: str, extra: Tuple[RequirementEntry, ...] = ()):
+        reasons = [
+            f"{name}{format_constraints(constraints)} (required by {required_by})"
+            for constraints, required_by, _ in [
+                *self.requirements.get(name, []),
+                *extra,
+            ]
+        ]
+
+        versions = self.provider.get_candidates(name)
+
+        if not versions:
+            available = "no versions are available for your system"
+        elif versions[0].installed:
+            available = f"installed: {versions[0].ver}"
+        else:
+            available = f"available in '{versions[0].repo.name}': " + ", ".join(
+                c.ver for c in versions
+            )
+
+        return f"Cannot satisfy '{name}': {', '.join(reasons)}; {available}"
+
+    def get_suitable(self, name: str) -> List[Candidate]:
+        return [
+            candidate
+            for candidate in self.provider.get_candidates(name)
+            if all(
+                version_satisfies(candidate.ver, constraints)
+                for constraints, _, _ in self.requirements[name]
+            )
+        ]
+
+    def get_failure_key(self, name: str) -> Tuple[str, FrozenSet[Constraints]]:
+        return name, frozenset(
+            constraints for constraints, _, _ in self.requirements[name]
+        )
+
+    def get_known_failure(self, name: str) -> Optional[Set[str]]:
+        culprits = self.failures.get(self.get_failure_key(name))
+
+        if culprits is None or any(
+            self.solution.get(culprit) != candidate
+            for culprit, candidate in culprits.items()
+        ):
+            return None
+
+        return set(culprits)
+
+    # Fetches the seeds of the newest suitable version of every undecided
+    # package at once, instead of one round trip per package
+    def prefetch(self, candidate: Candidate):
+        pending = [name for name in self.requirements if name not in self.solution]
+
+        self.provider.prefetch_candidates(pending)
+        self.provider.prefetch_seeds(
+            [
+                candidate,
+                *(
+                    suitable[0]
+                    for suitable in map(self.get_suitable, pending)
+                    if suitable
+                ),
+            ]
+        )
+
+    def advance(self, frame: _Frame) -> bool:
+        while frame.candidates:
+            candidate = frame.candidates.pop(0)
+
+            if not candidate.installed and candidate not in self.provider.seeds:
+                self.prefetch(candidate)
+
+            pkg_str = f"{candidate.name}=={candidate.ver}"
+            deps = [
+                parse_requirement(dep)
+                for dep in self.provider.get_dependencies(candidate)
+            ]
+
+            clash = next(
+                (
+                    dep
+                    for dep in deps
+                    if dep.name in self.solution
+                    and not version_satisfies(
+                        self.solution[dep.name].ver, dep.constraints
+                    )
+                ),
+                None,
+            )
+
+            if clash is not None:
+                frame.culprits.add(clash.name)
+                self.conflict = self.conflict or self.explain(
+                    clash.name, ((clash.constraints, pkg_str, frame.name),)
+                )
+                continue
+
+            self.solution[frame.name] = candidate
+
+            for dep in deps:
+                frame.added.append(
+                    self.add_requirement(dep.pkg_str, pkg_str, frame.name)
+                )
+
+            return True
+
+        return False
+
+    def undo(self, frame: _Frame):
+        del self.solution[frame.name]
+
+        for name in reversed(frame.added):
+            self.requirements[name].pop()
+
+            if not self.requirements[name]:
+                del self.requirements[name]
+
+        frame.added = []
+
+    # Undoes decisions up to the latest one the failure of the frame depends
+    # on. Other decisions made since had nothing to do with it, trying their
+    # older versions would only fail the same way
+    def backjump(self, frame: _Frame) -> _Frame:
+        name = frame.name
+        self.failures[self.get_failure_key(name)] = {
+            culprit: self.solution[culprit] for culprit in frame.culprits
+        }
+
+        culprits = frame.culprits | {
+            requirer
+            for _, _, requirer in self.requirements[name]
+            if requirer is not None
+        }
+
+        while self.trail:
+            frame = self.trail.pop()
+            self.undo(frame)
+
+            if frame.name in culprits:
+                frame.culprits |= culprits - {frame.name}
+                return frame
+
+        raise ResolutionError(self.conflict or self.explain(name))
+
+    def resolve(self, roots: Dict[str, List[str]]) -> Dict[str, Candidate]:
+        for required_by, pkg_strs in roots.items():
+            for pkg_str in pkg_strs:
+                self.add_requirement(pkg_str, required_by)
+
+        while True:
+            name = next(
+                (name for name in self.requirements if name not in self.solution), None
+            )
+
+            if name is None:
+                return self.solution
+
+            culprits = self.get_known_failure(name)
+
+            if culprits is not None:
+                frame = _Frame(name, [])
+                frame.culprits = culprits
+            else:
+                frame = _Frame(name, self.get_suitable(name))
+
+                if not frame.candidates:
+                    self.conflict = self.conflict or self.explain(name)
+
+            while not self.advance(frame):
+                frame = self.backjump(frame)
+
+            self.trail.append(frame)
@@ -0,0 +1,85 @@
+from typing import Dict
+
+
+class Version:
+    # Versions are interned: every distinct string is parsed once and the same
+    # object is returned afterwards, its comparison key is computed only once
+    __slots__ = ("string", "key")
+
+    interned: Dict[str, "Version"] = {}
+
+    def __new__(cls, string) -> "Version":
+        version = Version.interned.get(string, None)
+
+        if version is None:
+            if isinstance(string, Version):
+                return string
+
+            version = object.__new__(cls)
+            version.string = string
+            version.key = Version.make_key(string)
+            version = Version.interned.setdefault(string, version)
+
+        return version
+
+    # Every part adds a (type, value) pair to a flat key. Numeric parts compare
+    # as numbers, textual parts (1.0.a, 2.rc) compare as text and sort before
+    # numeric ones in the same position, so that any two versions are comparable
+    @staticmethod
+    def make_key(string: str) -> tuple:
+        key = []
+
+        for part in string.strip().split("."):
+            if part.isdigit():
+                key += (1, int(part))
+            else:
+                key += (0, part)
+
+        return tuple(key)
+
+    # A string that sorts the same way as the key, stored in remote.db so
+    # that SQLite can order and compare versions through an index
+    @property
+    def db_key(self) -> str:
+        parts = []
+
+        for part_type, value in zip(self.key[::2], self.key[1::2]):
+            if part_type == 1:
+                parts.append(f"1{len(str(value)):02d}{value}")
+            else:
+                parts.append(f"0{value}")
+
+        return " ".join(parts)
+
+    def __str__(self) -> str:
+        return self.string
+
+    def __repr__(self) -> str:
+        return f"Version('{self.string}')"
+
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, (Version, str)):
+            return NotImplemented
+
+        return self is other or self.key == Version(other).key
+
+    def __ne__(self, other) -> bool:
+        if not isinstance(other, (Version, str)):
+            return NotImplemented
+
+        return self is not other and self.key != Version(other).key
+
+    def __lt__(self, other) -> bool:
+        return self.key < Version(other).key
+
+    def __le__(self, other) -> bool:
+        return self.key <= Version(other).key
+
+    def __gt__(self, other) -> bool:
+        return self.key > Version(other).key
+
+    def __ge__(self, other) -> bool:
+        return self.key >= Version(other).key
@@ -0,0 +1,142 @@
+import os
+import sys
+import time
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+from colorama import Fore
+
+from larch import LARCH_CONFIG, LARCH_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Held by commands that change local.db, LARCH_TEMP or LARCH_PROG_DIR
+LARCH_LOCK = Path(LARCH_DIR) / ".lock"
+
+LOCK_POLL_INTERVAL = 0.1
+
+
+# An OSError, so that callers handling failed file operations handle it too
+class LockTimeout(TimeoutError):
+    pass
+
+
+def _try_lock(lock_file, shared: bool) -> bool:
+    try:
+        if fcntl is not None:
+            fcntl.flock(
+                lock_file.fileno(),
+                (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB,
+            )
+        else:
+            # Byte range locks on Windows are always exclusive
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+
+    return True
+
+
+def _unlock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _is_current(lock_file, lock_path: Union[str, Path]) -> bool:
+    if fcntl is None:
+        return True  # Open files cannot be removed on Windows
+
+    try:
+        return os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino
+    except FileNotFoundError:
+        return False
+
+
+def _acquire(
+    lock_path: Union[str, Path],
+    timeout: Optional[float],
+    shared: bool,
+    on_wait: Optional[Callable[[], None]],
+):
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    while True:
+        lock_file = open(lock_path, "a+b")
+
+        try:
+            while not _try_lock(lock_file, shared):
+                if on_wait is not None:
+                    on_wait()
+                    on_wait = None
+
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise LockTimeout(f"Timed out waiting for '{lock_path}'")
+
+                time.sleep(LOCK_POLL_INTERVAL)
+        except BaseException:
+            lock_file.close()
+            raise
+
+        # The last holder may have removed the file, a lock on it guards nothing
+        if _is_current(lock_file, lock_path):
+            return lock_file
+
+        _unlock(lock_file)
+        lock_file.close()
+
+
+# Advisory lock over a file, held by an open handle, so that it goes away
+# together with a crashed process. The holder may remove the file
+@contextmanager
+def file_lock(
+    lock_path: Union[str, Path],
+    timeout: Optional[float] = None,
+    shared=False,
+    on_wait: Optional[Callable[[], None]] = None,
+):
+    lock_file = _acquire(lock_path, timeout, shared, on_wait)
+
+    try:
+        yield
+    finally:
+        _unlock(lock_file)
+        lock_file.close()
+
+
+# Only for the holder of the lock. Open files cannot be removed on Windows,
+# the lock file is left there and reused
+def remove_lock_file(lock_path: Union[str, Path]):
+    if fcntl is not None:
+        Path(lock_path).unlink(missing_ok=True)
+
+
+@contextmanager
+def larch_lock():
+    with ExitStack() as stack:
+        try:
+            stack.enter_context(
+                file_lock(
+                    LARCH_LOCK,
+                    LARCH_CONFIG["lock_timeout"],
+                    on_wait=lambda: print(
+                        Fore.YELLOW + "Waiting for another larch process to finish..."
+                    ),
+                )
+            )
+        except LockTimeout:
+            print(
+                Fore.RED
+                + f"Another larch process is still running after {LARCH_CONFIG['lock_timeout']}s, stopping"
+            )
+            sys.exit(1)
+
+        yield
@@ -0,0 +1,98 @@
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from importlib.metadata import version
+from pathlib import Path
+from types import CodeType
+
+from RestrictedPython import compile_restricted
+
+from larch import LARCH_CONFIG, LARCH_DIR
+
+LARCH_SEED_BYTECODE = Path(LARCH_DIR) / "bytecode"
+
+MEMORY_CACHE_SIZE = 256
+
+memory_cache = OrderedDict()
+memory_cache_lock = threading.Lock()
+compiler_tag = None
+
+
+def get_compiler_tag() -> str:
+    global compiler_tag
+
+    if compiler_tag is None:
+        compiler_tag = f"RestrictedPython-{version('RestrictedPython')}|{sys.version}"
+
+    return compiler_tag
+
+
+def get_seed_key(code: str) -> str:
+    h = hashlib.sha256()
+    h.update(get_compiler_tag().encode())
+    h.update(b"\0")
+    h.update(code.encode())
+    return h.hexdigest()
+
+
+def _load_from_disk(cache_file: Path):
+    try:
+        byte_code = marshal.loads(cache_file.read_bytes())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+    if not isinstance(byte_code, CodeType):
+        return None
+
+    os.utime(cache_file)  # mtime doubles as the last access time
+    return byte_code
+
+
+def _store_on_disk(cache_file: Path, byte_code: CodeType):
+    LARCH_SEED_BYTECODE.mkdir(parents=True, exist_ok=True)
+
+    temp_fd, temp_path = tempfile.mkstemp(dir=LARCH_SEED_BYTECODE, suffix=".tmp")
+
+    with os.fdopen(temp_fd, "wb") as f:
+        f.write(marshal.dumps(byte_code))
+
+    os.replace(temp_path, cache_file)
+
+    cached_files = sorted(
+        LARCH_SEED_BYTECODE.glob("*.bin"), key=lambda f: f.stat().st_mtime
+    )
+
+    for stale_file in cached_files[: -LARCH_CONFIG["seed_bytecode_cache_size"]]:
+        stale_file.unlink(missing_ok=True)
+
+
+def compile_seed(code: str) -> CodeType:
+    key = get_seed_key(code)
+
+    with memory_cache_lock:
+        if key in memory_cache:
+            memory_cache.move_to_end(key)
+            return memory_cache[key]
+
+    cache_file = LARCH_SEED_BYTECODE / f"{key}.bin"
+    byte_code = _load_from_disk(cache_file)
+
+    if byte_code is None:
+        byte_code = compile_restricted(code, "<inline>", "exec")
+
+        try:
+            _store_on_disk(cache_file, byte_code)
+        except OSError:
+            pass  # A read-only or full disk only costs a recompilation
+
+    with memory_cache_lock:
+        memory_cache[key] = byte_code
+
+        while len(memory_cache) > MEMORY_CACHE_SIZE:
+            memory_cache.popitem(last=False)
+
+    return byte_code
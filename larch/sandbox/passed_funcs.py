@@ -1,20 +1,37 @@
+import gzip
+import heapq
+import lzma
 import os
 import os.path
 import shutil
 import subprocess
 import sys
+import tarfile
+import threading
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import BinaryIO, List, Tuple
 
 from colorama import Fore
 
+from larch import LARCH_CONFIG
+from larch.utils import CHUNK_SIZE, place_file
 from larch.utils import sp_print as print
 
-restricted_dirs = []
+try:
+    import zstandard
+except ImportError:  # tar.zst archives can only be unpacked when it is installed
+    zstandard = None
+
+# Seeds of independent packages are installed in parallel threads, each with
+# its own destination and temp dirs
+sandbox = threading.local()
 
 
 def validate_path(path: str):
     norm_path = os.path.abspath(os.path.normpath(path))
-    global restricted_dirs
+    restricted_dirs = getattr(sandbox, "restricted_dirs", [])
 
     if restricted_dirs:
         for restricted_dir in restricted_dirs:
@@ -34,14 +51,154 @@ def join_path(*args):
     return os.path.join(*args)
 
 
+def get_member_path(dest_folder: str, member_name: str) -> str:
+    member_path = os.path.abspath(os.path.join(dest_folder, member_name))
+
+    # Symlinks extracted earlier are followed, so that a link to '.' cannot be
+    # used as a stepping stone out of the folder
+    real_dest_folder = os.path.realpath(dest_folder)
+    real_member_path = os.path.realpath(os.path.join(dest_folder, member_name))
+
+    try:
+        is_inside = (
+            os.path.commonpath([real_dest_folder, real_member_path]) == real_dest_folder
+        )
+    except ValueError:  # Another drive on Windows
+        is_inside = False
+
+    if not is_inside:
+        print(
+            Fore.RED
+            + f"Archive member '{member_name}' points outside of '{dest_folder}'"
+        )
+        sys.exit(1)
+
+    validate_path(member_path)
+
+    return member_path
+
+
+def write_member(src: BinaryIO, member_path: str, size: int, mode: int):
+    if os.path.lexists(member_path):
+        os.unlink(member_path)  # Never write through a hardlink to the cache
+
+    with open(member_path, "wb") as output:
+        if size and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(output.fileno(), 0, size)
+            except OSError:
+                pass  # Not supported by the filesystem, the file just grows
+
+        shutil.copyfileobj(src, output, CHUNK_SIZE)
+
+    if mode & 0o111:
+        os.chmod(member_path, mode & 0o777)  # Keeps executables runnable
+
+
+def extract_zip(archive: str, dest_folder: str):
+    with zipfile.ZipFile(archive, "r") as zip_ref:
+        members = zip_ref.infolist()
+
+    files: List[Tuple[zipfile.ZipInfo, str]] = []
+
+    for member in members:
+        member_path = get_member_path(dest_folder, member.filename)
+
+        if member.is_dir():
+            os.makedirs(member_path, exist_ok=True)
+        else:
+            os.makedirs(os.path.dirname(member_path), exist_ok=True)
+            files.append((member, member_path))
+
+    # Every worker reads through its own handle, the biggest members are spread
+    # first so that the workers finish at about the same time
+    workers = max(
+        1, min(LARCH_CONFIG["extract_workers"], os.cpu_count() or 1, len(files))
+    )
+    buckets = [(0, i, []) for i in range(workers)]
+
+    for member, member_path in sorted(files, key=lambda f: -f[0].file_size):
+        size, i, bucket = heapq.heappop(buckets)
+        bucket.append((member, member_path))
+        heapq.heappush(buckets, (size + member.file_size, i, bucket))
+
+    def extract_bucket(bucket: List[Tuple[zipfile.ZipInfo, str]]):
+        with zipfile.ZipFile(archive, "r") as zip_ref:
+            for member, member_path in bucket:
+                with zip_ref.open(member) as src:
+                    write_member(
+                        src, member_path, member.file_size, member.external_attr >> 16
+                    )
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(extract_bucket, (bucket for _, _, bucket in buckets)))
+
+
+def open_tar_stream(archive: BinaryIO):
+    magic = archive.read(6)
+    archive.seek(0)
+
+    if magic.startswith(b"\x1f\x8b"):
+        return gzip.GzipFile(fileobj=archive)
+
+    if magic.startswith(b"\xfd7zXZ\x00"):
+        return lzma.LZMAFile(archive)
+
+    if magic.startswith(b"\x28\xb5\x2f\xfd"):
+        if zstandard is None:
+            print(Fore.RED + "Unpacking tar.zst archives requires 'zstandard'")
+            sys.exit(1)
+
+        return zstandard.ZstdDecompressor().stream_reader(archive)
+
+    return nullcontext(archive)
+
+
+def extract_tar(archive: str, dest_folder: str):
+    # A compressed tar can only be read front to back, so it is unpacked as a
+    # stream one member at a time and is never expanded in memory as a whole
+    with open(archive, "rb") as raw, open_tar_stream(raw) as stream, tarfile.open(
+        fileobj=stream, mode="r|"
+    ) as tar_ref:
+        for member in tar_ref:
+            member_path = get_member_path(dest_folder, member.name)
+
+            if member.isdir():
+                os.makedirs(member_path, exist_ok=True)
+                continue
+
+            os.makedirs(os.path.dirname(member_path), exist_ok=True)
+
+            if os.path.lexists(member_path):
+                os.unlink(member_path)
+
+            if member.isfile():
+                write_member(
+                    tar_ref.extractfile(member), member_path, member.size, member.mode
+                )
+            elif member.issym():
+                get_member_path(
+                    dest_folder,
+                    os.path.join(os.path.dirname(member.name), member.linkname),
+                )
+                os.symlink(member.linkname, member_path)
+            elif member.islnk():
+                os.link(get_member_path(dest_folder, member.linkname), member_path)
+            # Devices and fifos are never created by a seed
+
+
 def unzip(archive: str, dest_folder: str):
     validate_path(archive)
     validate_path(dest_folder)
 
     print(f"Unpacking '{archive}' to '{dest_folder}'...", end=" ")
 
-    with zipfile.ZipFile(archive, "r") as zip_ref:
-        zip_ref.extractall(dest_folder)
+    # zip, tar, tar.gz, tar.xz and tar.zst are told apart by their content,
+    # not by the file name
+    if zipfile.is_zipfile(archive):
+        extract_zip(archive, dest_folder)
+    else:
+        extract_tar(archive, dest_folder)
 
     print(Fore.GREEN + "Done", no_indentation=True)
 
@@ -52,7 +209,14 @@ def copytree(src: str, dst: str):
 
     print(f"Copying '{src}' to '{dst}'...", end=" ")
 
-    shutil.copytree(src, dst, dirs_exist_ok=True)
+    # Files of the temp dir may be hardlinks to the cache, so only reflinks
+    # are allowed here
+    shutil.copytree(
+        src,
+        dst,
+        copy_function=lambda s, d: place_file(s, d, hardlink=False),
+        dirs_exist_ok=True,
+    )
 
     print(Fore.GREEN + "Done", no_indentation=True)
 
@@ -63,7 +227,37 @@ def copyfile(src: str, dst: str):
 
     print(f"Copying '{src}' to '{dst}'...", end=" ")
 
-    shutil.copy2(src, dst)
+    place_file(src, dst, hardlink=False)
+
+    print(Fore.GREEN + "Done", no_indentation=True)
+
+
+def unshare_file(path: str):
+    if os.path.islink(path) or os.stat(path).st_nlink <= 1:
+        return
+
+    # Renaming a hardlink to a cache entry would make the installed file share
+    # its data, so a reflink or a copy takes its place first
+    temp_path = os.fspath(path) + ".unshared"
+    place_file(path, temp_path, hardlink=False)
+    os.replace(temp_path, path)
+
+
+def move(src: str, dst: str):
+    validate_path(src)
+    validate_path(dst)
+
+    print(f"Moving '{src}' to '{dst}'...", end=" ")
+
+    if os.path.isdir(src) and not os.path.islink(src):
+        for path, _, files in os.walk(src):
+            for file_name in files:
+                unshare_file(os.path.join(path, file_name))
+    else:
+        unshare_file(src)
+
+    # A rename within the same filesystem, the data is not written again
+    shutil.move(src, dst)
 
     print(Fore.GREEN + "Done", no_indentation=True)
 
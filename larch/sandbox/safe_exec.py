@@ -1,13 +1,20 @@
-import platform
+from RestrictedPython import safe_globals
 
-from RestrictedPython import compile_restricted, safe_globals
-
-from larch.sandbox.passed_funcs import copyfile, copytree, join_path, run, unzip
+from larch import CURRENT_ARCH
+from larch.sandbox.code_cache import compile_seed
+from larch.sandbox.passed_funcs import (
+    copyfile,
+    copytree,
+    join_path,
+    move,
+    run,
+    unzip,
+)
 
 
 def safe_exec_seed(code: str):
     loc = {}
-    byte_code = compile_restricted(code, "<inline>", "exec")
+    byte_code = compile_seed(code)
 
     exec(
         byte_code,
@@ -17,8 +24,9 @@ def safe_exec_seed(code: str):
             "unzip": unzip,
             "copytree": copytree,
             "copyfile": copyfile,
+            "move": move,
             "run": run,
-            "CURRENT_ARCH": platform.system() + "_" + platform.architecture()[0],
+            "CURRENT_ARCH": CURRENT_ARCH,
         },
         loc,
     )
@@ -0,0 +1,135 @@
+import io
+import os
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3.response import HTTPResponse
+from urllib3.util.retry import Retry
+
+from larch import LARCH_CONFIG
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/111.0.0.0 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.9,it;q=0.8,es;q=0.7",
+    "Accept-Encoding": "identity",
+    "Referer": "https://google.com/",
+}
+
+
+def is_not_modified(request, etag: str, stat: os.stat_result) -> bool:
+    if_none_match = request.headers.get("If-None-Match")
+
+    if if_none_match is not None:
+        return if_none_match.strip() == "*" or etag in (
+            tag.strip() for tag in if_none_match.split(",")
+        )
+
+    if_modified_since = request.headers.get("If-Modified-Since")
+
+    if if_modified_since is None:
+        return False
+
+    try:
+        since = parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+    # HTTP dates have a resolution of a second
+    return int(stat.st_mtime) <= since
+
+
+# Serves file:// URLs, so that a local folder can stand in for a repository.
+# Validators are made up like a web server does, from the mtime and size
+class FileAdapter(BaseAdapter):
+    def send(self, request, **kwargs):
+        path = Path(url2pathname(urlparse(request.url).path))
+
+        if path.is_file():
+            stat = path.stat()
+            etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+            headers = {
+                "ETag": etag,
+                "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+            }
+
+            if is_not_modified(request, etag, stat):
+                status, body = 304, io.BytesIO()
+            else:
+                status, body = 200, path.open("rb")
+                headers["Content-Length"] = str(stat.st_size)
+        else:
+            status, body, headers = 404, io.BytesIO(), {}
+
+        response = HTTPAdapter().build_response(
+            request,
+            HTTPResponse(
+                body=body,
+                headers=headers,
+                status=status,
+                preload_content=False,
+                decode_content=False,
+            ),
+        )
+
+        if request.method == "HEAD":
+            body.close()
+
+        return response
+
+    def close(self):
+        pass
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=LARCH_CONFIG["http_retries"],
+                backoff_factor=LARCH_CONFIG["http_backoff"],
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=("GET", "HEAD"),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=LARCH_CONFIG["http_pool_size"],
+                pool_maxsize=LARCH_CONFIG["http_pool_size"],
+                max_retries=retry,
+            )
+
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.mount("file://", FileAdapter())
+
+            _session = session
+
+    return _session
+
+
+def _request(method: str, url: str, **kwargs) -> requests.Response:
+    kwargs.setdefault(
+        "timeout",
+        (LARCH_CONFIG["http_connect_timeout"], LARCH_CONFIG["http_read_timeout"]),
+    )
+
+    return get_session().request(method, url, **kwargs)
+
+
+def http_get(url: str, **kwargs) -> requests.Response:
+    return _request("GET", url, **kwargs)
+
+
+def http_head(url: str, **kwargs) -> requests.Response:
+    return _request("HEAD", url, **kwargs)
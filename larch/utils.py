@@ -1,21 +1,40 @@
 import hashlib
+import json
+import os
 import shutil
+import sys
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from functools import partial
 from io import BytesIO
 from pathlib import Path
-from typing import Optional, Union
+from typing import Dict, Optional, Tuple, Union
 
 import requests
 from colorama import Fore
 from tqdm.auto import tqdm
 
-from larch import LARCH_CACHE
+from larch import LARCH_CACHE, LARCH_CONFIG
+from larch.database.cache import (
+    cache_contains,
+    cache_entry_lock,
+    cache_evict,
+    cache_lookup,
+    cache_register,
+)
+from larch.session import HEADERS, http_get, http_head
 
-HEADERS = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/111.0.0.0 Safari/537.36",
-    "Accept-Language": "en-US,en;q=0.9,it;q=0.8,es;q=0.7",
-    "Accept-Encoding": "identity",
-    "Referer": "https://google.com/",
-}
+try:
+    import fcntl
+except ImportError:  # Windows has no reflinks to offer anyway
+    fcntl = None
+
+CHUNK_SIZE = 64 * 1024
+
+# From linux/fs.h, exposed by the fcntl module only since Python 3.12
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
+
+progress_lock = threading.Lock()
 
 indentation_level = 0
 indentation = "  "
@@ -35,61 +54,433 @@ def sp_print(*args, **kwargs):
     print(*args, **kwargs)
 
 
-def str_to_version_tuple(ver: str) -> tuple:
-    result = []
+def hashify(obj: str):
+    h = hashlib.new("sha1")
+    h.update(obj.encode())
+    return h.hexdigest()
+
+
+def _reflink(src: Union[str, Path], dest: Union[str, Path]) -> bool:
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return False
+
+    try:
+        with open(src, "rb") as src_file, open(dest, "wb") as dest_file:
+            fcntl.ioctl(dest_file.fileno(), FICLONE, src_file.fileno())
+    except OSError:
+        Path(dest).unlink(missing_ok=True)
+        return False
+
+    shutil.copystat(src, dest)
+
+    return True
+
+
+def place_file(src: Union[str, Path], dest: Union[str, Path], hardlink=True):
+    # A reflink shares the data copy-on-write (btrfs, XFS), a hardlink shares
+    # the very same file, which is safe for cache entries since they are only
+    # ever replaced, never written in place. Copying is the last resort
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, os.path.basename(src))
+
+    if os.path.lexists(dest):
+        os.unlink(dest)  # Never write through an existing hardlink
+
+    if _reflink(src, dest):
+        return
+
+    if hardlink and LARCH_CONFIG["cache_hardlinks"]:
+        try:
+            os.link(src, dest)
+            return
+        except OSError:
+            pass  # Another device, FAT or the link count limit
+
+    shutil.copy2(src, dest)
+
+
+class FetchCancelled(Exception):
+    pass
+
+
+class IncompleteDownload(Exception):
+    pass
+
+
+def _read_part_meta(part_meta_file: Path, url: str) -> dict:
+    try:
+        part_meta = json.loads(part_meta_file.read_text())
+    except (OSError, ValueError):
+        return {}
+
+    return part_meta if part_meta.get("url") == url else {}
+
 
-    for i in ver.split("."):
-        if i.isdigit():
-            result.append(int(i))
+def _download_part(
+    url: str,
+    part_file: Path,
+    part_meta_file: Path,
+    progress: tqdm,
+    progress_state: dict,
+    cancel: Optional[threading.Event] = None,
+):
+    part_meta = _read_part_meta(part_meta_file, url)
+    offset = part_file.stat().st_size if part_file.is_file() and part_meta else 0
+    headers = dict(HEADERS)
+
+    if offset > 0:
+        headers["Range"] = f"bytes={offset}-"
+
+        if part_meta.get("validator"):
+            headers["If-Range"] = part_meta["validator"]
+
+    with http_get(
+        url,
+        stream=True,
+        headers=headers,
+    ) as r:
+        if r.status_code == 416 and offset == part_meta.get("total"):
+            return  # The previous attempt has got every byte already
+
+        r.raise_for_status()
+
+        if r.status_code == 206:
+            total_length = int(r.headers.get("Content-Range", "/0").split("/")[-1])
+
+            if part_meta.get("total") and total_length != part_meta["total"]:
+                offset = 0  # The file has changed on the server, start over
+                r.close()
+                part_file.unlink(missing_ok=True)
+                part_meta_file.unlink(missing_ok=True)
+                return _download_part(
+                    url, part_file, part_meta_file, progress, progress_state, cancel
+                )
         else:
-            result.append(i)
+            offset = 0
+            total_length = int(r.headers.get("Content-Length", 0))
 
-    return tuple(result)
+        part_meta_file.write_text(
+            json.dumps(
+                {
+                    "url": url,
+                    "validator": r.headers.get("ETag")
+                    or r.headers.get("Last-Modified"),
+                    "total": total_length,
+                }
+            )
+        )
 
+        with progress_lock:
+            progress.total = (
+                (progress.total or 0) + total_length - progress_state["total"]
+            )
+            progress.update(offset - progress_state["n"])
+            progress_state.update(total=total_length, n=offset)
 
-def hashify(obj: str):
-    h = hashlib.new("sha1")
-    h.update(obj.encode())
-    return h.hexdigest()
+        with open(part_file, "ab" if offset else "wb") as output:
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                if cancel is not None and cancel.is_set():
+                    raise FetchCancelled(url)
+
+                output.write(chunk)
+
+                with progress_lock:
+                    progress.update(len(chunk))
+                    progress_state["n"] += len(chunk)
+
+    if total_length and part_file.stat().st_size != total_length:
+        raise IncompleteDownload(
+            f"Got {part_file.stat().st_size} of {total_length} bytes from '{url}'"
+        )
+
+
+def _probe_segmentable(url: str) -> Optional[Tuple[str, int, Optional[str]]]:
+    with http_head(url, allow_redirects=True) as r:
+        if r.status_code != 200 or r.headers.get("Accept-Ranges") != "bytes":
+            return None
+
+        total_length = int(r.headers.get("Content-Length", 0))
+
+        if total_length < LARCH_CONFIG["segment_min_size_mb"] * 1024**2:
+            return None
+
+        return r.url, total_length, r.headers.get("ETag")
+
+
+def _download_segment(
+    url: str,
+    part_file: Path,
+    start: int,
+    end: int,
+    validator: Optional[str],
+    progress: tqdm,
+    progress_state: dict,
+    cancel_events: Tuple[threading.Event, ...],
+):
+    pos = start
+
+    for attempt in range(LARCH_CONFIG["download_retries"] + 1):
+        headers = {**HEADERS, "Range": f"bytes={pos}-{end}"}
+
+        if validator:
+            headers["If-Range"] = validator
+
+        try:
+            with http_get(url, stream=True, headers=headers) as r:
+                r.raise_for_status()
+
+                if r.status_code != 206:
+                    raise IncompleteDownload(f"'{url}' ignored the byte range request")
+
+                with open(part_file, "r+b") as output:
+                    output.seek(pos)
+
+                    for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                        if any(event.is_set() for event in cancel_events):
+                            raise FetchCancelled(url)
+
+                        output.write(chunk[: end + 1 - pos])
+                        pos += len(chunk)
+
+                        with progress_lock:
+                            progress.update(len(chunk))
+                            progress_state["n"] += len(chunk)
+
+            if pos >= end + 1:
+                return
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ):
+            if attempt == LARCH_CONFIG["download_retries"]:
+                raise
+
+    raise IncompleteDownload(
+        f"Got {pos - start} of {end + 1 - start} bytes from '{url}'"
+    )
+
+
+def _download_segmented(
+    url: str,
+    part_file: Path,
+    total_length: int,
+    validator: Optional[str],
+    progress: tqdm,
+    cancel: Optional[threading.Event] = None,
+):
+    segments = LARCH_CONFIG["segmented_connections"]
+    segment_size = -(-total_length // segments)
+    segment_cancel = threading.Event()
+    progress_state = {"n": 0}
+
+    with open(part_file, "wb") as output:
+        output.truncate(total_length)  # Preallocate, every segment seeks into place
+
+    with progress_lock:
+        progress.total = (progress.total or 0) + total_length
+        progress.refresh()
+
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        futures = [
+            executor.submit(
+                _download_segment,
+                url,
+                part_file,
+                start,
+                min(start + segment_size, total_length) - 1,
+                validator,
+                progress,
+                progress_state,
+                (segment_cancel, cancel) if cancel else (segment_cancel,),
+            )
+            for start in range(0, total_length, segment_size)
+        ]
+
+        done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+        failed = [f for f in done if f.exception() is not None]
+
+        if failed:
+            segment_cancel.set()
+            wait(not_done)
+
+            with progress_lock:
+                progress.total -= total_length
+                progress.update(-progress_state["n"])
+
+            part_file.unlink(missing_ok=True)
+            raise failed[0].exception()
+
+
+def _download(
+    url: str,
+    dest: Union[str, Path],
+    progress: tqdm,
+    cancel: Optional[threading.Event] = None,
+    segmented=False,
+):
+    # Bytes land in '<dest>.part' and are resumed with Range requests on retry;
+    # dest itself only appears once the file is complete
+    part_file = Path(str(dest) + ".part")
+    part_meta_file = Path(str(dest) + ".part.json")
+    progress_state = {"total": 0, "n": 0}
+
+    if segmented and LARCH_CONFIG["segmented_connections"] > 1:
+        probe = None if part_meta_file.is_file() else _probe_segmentable(url)
+
+        if probe is not None:
+            segments_url, total_length, validator = probe
+
+            try:
+                _download_segmented(
+                    segments_url, part_file, total_length, validator, progress, cancel
+                )
+            except FetchCancelled:
+                raise
+            except (requests.RequestException, IncompleteDownload):
+                pass  # Fall back to a single resumable stream
+            else:
+                os.replace(part_file, dest)
+                return
+
+    for attempt in range(LARCH_CONFIG["download_retries"] + 1):
+        try:
+            _download_part(
+                url, part_file, part_meta_file, progress, progress_state, cancel
+            )
+            break
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+            IncompleteDownload,
+        ):
+            if attempt == LARCH_CONFIG["download_retries"]:
+                raise
+        except requests.HTTPError:
+            part_file.unlink(missing_ok=True)
+            part_meta_file.unlink(missing_ok=True)
+            raise
+
+    os.replace(part_file, dest)
+    part_meta_file.unlink(missing_ok=True)
+
+
+def _fetch_to_cache(
+    url: str,
+    dest: Union[str, Path],
+    progress: tqdm,
+    cancel: Optional[threading.Event] = None,
+):
+    url_hash = hashify(url)
+    cache_file = Path(LARCH_CACHE / url_hash)
+
+    # One process downloads an entry, the others wait here and reuse it. The
+    # entry itself only appears once it is complete, see _download
+    with cache_entry_lock(url_hash):
+        if not cache_contains(url_hash):
+            _download(url, cache_file, progress, cancel, segmented=True)
+            cache_register(url_hash, url)
+
+        place_file(cache_file, dest)
+
+
+def _place_cached(url: str, dest: Union[str, Path]) -> bool:
+    url_hash = hashify(url)
+
+    # Waits for a download of the same entry by another process, if any
+    with cache_entry_lock(url_hash, shared=True):
+        cache_file = cache_lookup(url_hash)
+
+        if cache_file is None:
+            return False
+
+        place_file(cache_file, dest)
+
+    return True
 
 
 def progress_fetch(url: str, dest: Optional[Union[str, BytesIO]], no_cache=False):
     if no_cache:
-        with requests.get(
-            url,
-            stream=True,
-            headers=HEADERS,
-        ) as r:
-            total_length = int(r.headers.get("Content-Length"))
-
-            with tqdm.wrapattr(r.raw, "read", total=total_length) as raw:
-                with open(dest, "wb") as output:
-                    shutil.copyfileobj(raw, output)
+        with tqdm(unit="B", unit_scale=True, unit_divisor=1024) as progress:
+            _download(url, dest, progress)
 
         return
 
     sp_print(f"Fetching '{url}' to '{dest}'...", end=" ")
 
     # Try to find in cache
-    url_hash = hashify(url)
-    possible_cache_file = Path(LARCH_CACHE / url_hash)
-
-    if not possible_cache_file.is_file():
+    if _place_cached(url, dest):
+        sp_print(Fore.GREEN + "Using cached", no_indentation=True)
+    else:
         sp_print()
 
-        with requests.get(
-            url,
-            stream=True,
-            headers=HEADERS,
-        ) as r:
-            total_length = int(r.headers.get("Content-Length"))
+        with tqdm(unit="B", unit_scale=True, unit_divisor=1024) as progress:
+            _fetch_to_cache(url, dest, progress)
+
+    cache_evict()
+
+
+def progress_fetch_many(
+    files: Dict[Union[str, Path], str],
+    max_workers: Optional[int] = None,
+    no_cache=False,
+):
+    # One shared progress bar; the first failure cancels the rest and is re-raised
+    if not files:
+        return
+
+    if max_workers is None:
+        max_workers = LARCH_CONFIG["fetch_workers"]
+
+    to_download = {}
+
+    for dest, url in files.items():
+        if not no_cache and _place_cached(url, dest):
+            sp_print(f"Fetching '{url}' to '{dest}'...", end=" ")
+            sp_print(Fore.GREEN + "Using cached", no_indentation=True)
+        else:
+            sp_print(f"Fetching '{url}' to '{dest}'...")
+            to_download[dest] = url
+
+    if to_download:
+        cancel = threading.Event()
+        fetch = partial(_download, segmented=True) if no_cache else _fetch_to_cache
+
+        with tqdm(
+            unit="B",
+            unit_scale=True,
+            unit_divisor=1024,
+            desc=f"{len(to_download)} file(s)",
+        ) as progress, ThreadPoolExecutor(
+            max_workers=max(1, min(max_workers, len(to_download)))
+        ) as executor:
+            futures = [
+                executor.submit(fetch, url, dest, progress, cancel)
+                for dest, url in to_download.items()
+            ]
+
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            failed = [f for f in done if f.exception() is not None]
+
+            if failed:
+                cancel.set()
+
+                for future in not_done:
+                    future.cancel()
+
+                wait(not_done)
+                raise failed[0].exception()
+
+    if not no_cache:
+        cache_evict()
 
-            with tqdm.wrapattr(r.raw, "read", total=total_length) as raw:
-                with open(possible_cache_file, "wb") as output:
-                    shutil.copyfileobj(raw, output)
-    else:
-        sp_print(Fore.GREEN + "Using cached", no_indentation=True)
 
-    shutil.copy(possible_cache_file, dest)
-    return
-    # endregion
+def fetch_sources(sources: Dict[str, str], temp_dir: Path):
+    try:
+        progress_fetch_many(
+            {temp_dir / dest_file_name: url for dest_file_name, url in sources.items()}
+        )
+    except (requests.RequestException, OSError) as e:
+        sp_print(Fore.RED + f"Failed to fetch package sources: {e}")
+        sys.exit(1)
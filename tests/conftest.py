@@ -0,0 +1,169 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+# larch picks its folder from the home directory at import time, so the tests
+# never get to see the real one
+os.environ["HOME"] = os.environ["USERPROFILE"] = tempfile.mkdtemp(prefix="larch-")
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# Nothing listens there, a command that goes online fails loudly
+OFFLINE_REPO = "http://127.0.0.1:9/"
+
+
+@pytest.fixture
+def larch_home(tmp_path) -> Path:
+    larch_dir = tmp_path / ".larch"
+    larch_dir.mkdir()
+    (larch_dir / "repo.txt").write_text(OFFLINE_REPO)
+    # Failing to reach it right away is enough
+    (larch_dir / "config.json").write_text(json.dumps({"http_retries": 0}))
+
+    return tmp_path
+
+
+@pytest.fixture
+def run_larch(larch_home):
+    def run(*args: str) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            [sys.executable, "-c", "from larch.cli import run_cli; run_cli()", *args],
+            cwd=ROOT_DIR,
+            env={**os.environ, "HOME": str(larch_home), "USERPROFILE": str(larch_home)},
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+
+    return run
+
+
+@pytest.fixture
+def demo_package(larch_home, run_larch):
+    run_larch("list", "-i")  # Creates local.db
+
+    with sqlite3.connect(larch_home / ".larch" / "local.db") as conn:
+        conn.execute(
+            "INSERT INTO packages (name, version, description, author, maintainer, "
+            "url, license, entry_point) VALUES ('demo', '1.0', '', '', '', '', "
+            "'MIT', 'run.sh')"
+        )
+
+    entry_point = larch_home / ".larch" / "packages" / "demo" / "run.sh"
+    entry_point.parent.mkdir(parents=True)
+    entry_point.write_text("#!/bin/sh\n")
+    entry_point.chmod(0o755)
+
+
+@pytest.fixture
+def repos_dir(tmp_path, monkeypatch):
+    from larch.database import repos
+
+    monkeypatch.setattr(repos, "LARCH_REPOS_DIR", tmp_path / "repos")
+    monkeypatch.setattr(repos, "checked_repo_dirs", set())
+
+    return tmp_path / "repos"
+
+
+class RepoRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_empty(self, status: int, **headers):
+        self.send_response(status)
+
+        for name, value in {"Content-Length": "0", **headers}.items():
+            self.send_header(name, value)
+
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        server = self.server
+        path = server.root / self.path.lstrip("/").split("?")[0]
+        server.requests.append((self.command, self.path, self.headers.get("Range")))
+
+        if not path.is_file():
+            return self.send_empty(404)
+
+        data = path.read_bytes()
+        etag = f'"{len(data)}-{path.stat().st_mtime_ns}"'
+
+        if self.headers.get("If-None-Match") == etag:
+            return self.send_empty(304, ETag=etag)
+
+        start, end, status = 0, len(data) - 1, 200
+        range_header = self.headers.get("Range")
+
+        if (
+            server.ranges
+            and range_header
+            and self.headers.get("If-Range")
+            in (
+                None,
+                etag,
+            )
+        ):
+            first, last = range_header.split("=")[1].split("-")
+            start, status = int(first), 206
+            end = int(last) if last else end
+
+            if start >= len(data):
+                return self.send_empty(416, **{"Content-Range": f"bytes */{len(data)}"})
+
+        stop = end + 1
+        body = data[start:stop]
+
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+
+        if server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+
+        self.end_headers()
+
+        if head:
+            return
+
+        if server.cut_after:
+            # Drops the connection half way, once
+            self.wfile.write(body[: server.cut_after])
+            server.cut_after = 0
+            self.close_connection = True
+            return
+
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def http_server(tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RepoRequestHandler)
+    server.root = tmp_path / "www"
+    server.root.mkdir()
+    server.requests = []
+    server.ranges = True
+    server.cut_after = 0
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
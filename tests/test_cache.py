@@ -0,0 +1,51 @@
+import sys
+
+from larch import LARCH_CACHE, lock
+from larch.database.cache import (
+    cache_clear,
+    cache_contains,
+    cache_entry_lock,
+    cache_register,
+)
+
+
+def add_entry(key: str):
+    (LARCH_CACHE / key).write_bytes(b"data")
+    cache_register(key, f"http://127.0.0.1:9/{key}")
+
+
+def test_clear_skips_locked_entries():
+    add_entry("idle")
+    add_entry("busy")
+    (LARCH_CACHE / "stale.part").write_bytes(b"da")
+    (LARCH_CACHE / "busy-too.part").write_bytes(b"da")
+
+    # Another process is placing one entry and downloading another
+    with cache_entry_lock("busy", shared=True), cache_entry_lock("busy-too"):
+        cache_clear()
+
+        assert not cache_contains("idle")
+        assert not (LARCH_CACHE / "stale.part").exists()
+        assert cache_contains("busy")
+        assert (LARCH_CACHE / "busy-too.part").exists()
+        assert (LARCH_CACHE / "busy-too.lock").exists()
+
+    cache_clear()
+
+    assert not cache_contains("busy")
+    assert not any(
+        path.suffix != ".lock" or sys.platform != "win32"
+        for path in LARCH_CACHE.glob("busy*")
+    )
+
+
+def test_lock_files_stay_where_open_files_cannot_be_removed(monkeypatch):
+    add_entry("windows")
+
+    with cache_entry_lock("windows"):
+        # Only the removal acts as on Windows, the lock itself is a real one
+        monkeypatch.setattr(lock, "fcntl", None)
+        lock.remove_lock_file(LARCH_CACHE / "windows.lock")
+        monkeypatch.undo()
+
+    assert (LARCH_CACHE / "windows.lock").exists()
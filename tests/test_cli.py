@@ -0,0 +1,11 @@
+import pytest
+
+
+@pytest.mark.parametrize("command", ["install app", "mirror out app"])
+@pytest.mark.parametrize("jobs", ["0", "-1", "many"])
+def test_rejects_bad_job_count(run_larch, command, jobs):
+    result = run_larch(*command.split(), "-j", jobs)
+
+    assert result.returncode == 2
+    assert "expected a positive number" in result.stderr
+    assert "Traceback" not in result.stderr
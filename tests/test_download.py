@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+from larch import LARCH_CONFIG
+from larch.utils import progress_fetch
+
+
+@pytest.fixture
+def payload(http_server, request):
+    data = os.urandom(1024 * 1024)
+    (http_server.root / f"{request.node.name}.bin").write_bytes(data)
+
+    return http_server.url + f"{request.node.name}.bin", data
+
+
+@pytest.fixture
+def segmented(monkeypatch):
+    monkeypatch.setitem(LARCH_CONFIG, "segmented_connections", 4)
+    monkeypatch.setitem(LARCH_CONFIG, "segment_min_size_mb", 0)
+
+
+def get_ranges(http_server):
+    return [rng for method, _, rng in http_server.requests if method == "GET" and rng]
+
+
+def test_segmented_download(tmp_path, http_server, payload, segmented):
+    url, data = payload
+
+    progress_fetch(url, tmp_path / "out.bin")
+
+    assert (tmp_path / "out.bin").read_bytes() == data
+    assert len(get_ranges(http_server)) == 4
+
+
+def test_falls_back_without_accept_ranges(tmp_path, http_server, payload, segmented):
+    url, data = payload
+    http_server.ranges = False
+
+    progress_fetch(url, tmp_path / "out.bin")
+
+    assert (tmp_path / "out.bin").read_bytes() == data
+    assert get_ranges(http_server) == []
+
+
+def test_resumes_dropped_download(tmp_path, http_server, payload):
+    url, data = payload
+    http_server.cut_after = 300 * 1024
+
+    progress_fetch(url, tmp_path / "out.bin")
+
+    assert (tmp_path / "out.bin").read_bytes() == data
+    # Picks up from wherever the dropped response got to
+    [resume_range] = get_ranges(http_server)
+    assert 0 < int(resume_range.strip("bytes=-")) <= 300 * 1024
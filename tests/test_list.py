@@ -0,0 +1,23 @@
+import json
+
+
+def test_piped_json_parses(run_larch, demo_package):
+    result = run_larch("list", "-i", "-f", "json")
+
+    assert result.returncode == 0, result.stderr
+    assert [pkg["name"] for pkg in json.loads(result.stdout)] == ["demo"]
+
+
+def test_piped_ndjson_parses(run_larch, demo_package):
+    result = run_larch("list", "-i", "-f", "ndjson")
+
+    assert result.returncode == 0, result.stderr
+    assert [json.loads(line)["name"] for line in result.stdout.splitlines()] == ["demo"]
+
+
+def test_piped_table_has_no_color_codes(run_larch, demo_package):
+    result = run_larch("list", "-i", "-f", "table")
+
+    assert result.returncode == 0, result.stderr
+    assert "\x1b" not in result.stdout
+    assert "| demo" in result.stdout
@@ -0,0 +1,68 @@
+import os
+import tarfile
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from larch.sandbox.passed_funcs import move, unzip
+
+
+@pytest.fixture
+def cache_entry(tmp_path):
+    entry = tmp_path / "cache" / "entry"
+    entry.parent.mkdir()
+    entry.write_bytes(b"cached")
+
+    return entry
+
+
+# Seeds pass both strings and Path objects
+@pytest.mark.parametrize("as_path", [str, Path], ids=["str", "Path"])
+def test_move_does_not_share_cache_entry(tmp_path, cache_entry, as_path):
+    source = tmp_path / "temp" / "source.bin"
+    source.parent.mkdir()
+    os.link(cache_entry, source)
+
+    move(as_path(source), as_path(tmp_path / "installed.bin"))
+
+    assert not source.exists()
+    assert (tmp_path / "installed.bin").read_bytes() == b"cached"
+    assert cache_entry.stat().st_nlink == 1
+
+
+def test_move_unshares_files_of_folder(tmp_path, cache_entry):
+    folder = tmp_path / "temp" / "app"
+    folder.mkdir(parents=True)
+    os.link(cache_entry, folder / "source.bin")
+    (folder / "own.txt").write_text("own")
+
+    move(str(folder), str(tmp_path / "installed"))
+
+    assert (tmp_path / "installed" / "source.bin").read_bytes() == b"cached"
+    assert (tmp_path / "installed" / "own.txt").read_text() == "own"
+    assert cache_entry.stat().st_nlink == 1
+
+
+@pytest.mark.parametrize("archive_format", ["zip", "tar"])
+def test_unzip_does_not_write_through_cache_entry(
+    tmp_path, cache_entry, archive_format
+):
+    temp_dir = tmp_path / "temp"
+    temp_dir.mkdir()
+    os.link(cache_entry, temp_dir / "lib.bin")
+
+    (tmp_path / "lib.bin").write_bytes(b"unpacked")
+    archive = tmp_path / f"app.{archive_format}"
+
+    if archive_format == "zip":
+        with zipfile.ZipFile(archive, "w") as zip_ref:
+            zip_ref.write(tmp_path / "lib.bin", "lib.bin")
+    else:
+        with tarfile.open(archive, "w:gz") as tar_ref:
+            tar_ref.add(tmp_path / "lib.bin", "lib.bin")
+
+    unzip(str(archive), str(temp_dir))
+
+    assert (temp_dir / "lib.bin").read_bytes() == b"unpacked"
+    assert cache_entry.read_bytes() == b"cached"
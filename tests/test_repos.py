@@ -0,0 +1,66 @@
+import pytest
+
+from larch import Repository
+from larch.database import repos
+
+
+def test_keeps_state_of_same_url(repos_dir):
+    repo_dir = repos.get_repo_dir(Repository("extra", "http://a.example/"))
+    (repo_dir / "remote.db").write_bytes(b"catalog")
+
+    repos.checked_repo_dirs.clear()
+
+    assert repos.get_repo_dir(Repository("extra", "http://a.example/")) == repo_dir
+    assert (repo_dir / "remote.db").read_bytes() == b"catalog"
+
+
+def test_discards_state_when_url_changes(repos_dir):
+    repo_dir = repos.get_repo_dir(Repository("extra", "http://a.example/"))
+    (repo_dir / "remote.db").write_bytes(b"catalog")
+    (repo_dir / "sparse").mkdir()
+
+    repos.checked_repo_dirs.clear()
+
+    assert repos.get_repo_dir(Repository("extra", "http://b.example/")) == repo_dir
+    assert sorted(path.name for path in repo_dir.iterdir()) == [repos.REPO_URL_FILE]
+    assert repos.read_repo_url(repo_dir) == "http://b.example/"
+
+
+def test_reports_empty_repo_list(larch_home, run_larch):
+    (larch_home / ".larch" / "repo.txt").write_text("# nothing here\n\n")
+
+    assert run_larch("--version").returncode == 0
+    assert run_larch("list", "-i").returncode == 0
+
+    result = run_larch("update")
+
+    assert result.returncode == 1
+    assert "No repositories are listed" in result.stdout
+
+
+def test_refuses_folder_outside_repos(repos_dir):
+    (repos_dir / "keep").mkdir(parents=True)
+
+    with pytest.raises(SystemExit):
+        repos.get_repo_dir(Repository("..", "http://a.example/"))
+
+    assert (repos_dir / "keep").is_dir()
+
+
+@pytest.mark.parametrize(
+    "repo_txt, error",
+    [
+        (".. file:///x/\n", "'..' cannot be a repository name"),
+        ("a/b file:///x/\n", "'a/b' cannot be a repository name"),
+        ("one file:///x/\none file:///y/\n", "'one' is used twice"),
+    ],
+)
+def test_reports_bad_repo_lines(larch_home, run_larch, repo_txt, error):
+    (larch_home / ".larch" / "repo.txt").write_text(repo_txt)
+    run_larch("list", "-i")  # Creates local.db
+
+    result = run_larch("update")
+
+    assert result.returncode == 1
+    assert error in result.stdout
+    assert (larch_home / ".larch" / "local.db").is_file()
@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+from larch import Repository
+from larch.dep_tree.resolver import Candidate, ResolutionError, Resolver, SeedProvider
+
+REPO = Repository("main", "http://127.0.0.1:9/")
+
+
+# Serves a made up repository from memory, every seed is already "fetched"
+class GraphProvider(SeedProvider):
+    def __init__(self, graph):
+        super().__init__()
+
+        for name, versions in graph.items():
+            self.candidates[name] = []
+
+            for ver, deps in versions.items():
+                candidate = Candidate(name, ver, "any", REPO, False)
+                self.candidates[name].append(candidate)
+                self.dependencies[candidate] = deps
+                self.seeds[candidate] = ""
+
+    def get_candidates(self, pkg_name):
+        return self.candidates.get(pkg_name, [])
+
+
+def resolve(graph, pkg_strs):
+    solution = Resolver(GraphProvider(graph)).resolve({"@user": pkg_strs})
+
+    return {name: candidate.ver for name, candidate in solution.items()}
+
+
+def test_picks_older_version_on_conflict():
+    graph = {
+        "app": {"2.0": ["lib>=2.0"], "1.0": ["lib"]},
+        "tool": {"1.0": ["lib<2.0"]},
+        "lib": {"2.0": [], "1.0": []},
+    }
+
+    assert resolve(graph, ["tool", "app"]) == {
+        "tool": "1.0",
+        "lib": "1.0",
+        "app": "1.0",
+    }
+
+
+def test_reports_unsatisfiable_requirement():
+    graph = {"app": {"1.0": ["lib>=2.0"]}, "lib": {"1.0": []}}
+
+    with pytest.raises(ResolutionError, match="Cannot satisfy 'lib'"):
+        resolve(graph, ["app"])
+
+
+def chain_graph(length: int, leaf_deps):
+    graph = {}
+
+    for i in range(length):
+        deps = [f"p{i + 1}"] if i + 1 < length else leaf_deps
+        graph[f"p{i}"] = {f"{ver}.0": deps for ver in (3, 2, 1)}
+
+    return graph
+
+
+def test_resolves_thousands_of_packages_in_budget():
+    # Every package depends on the two after it in a binary tree, with a
+    # constraint that rules out the newest version of each one
+    graph = {}
+    count = 3000
+
+    for i in range(count):
+        deps = [f"p{child}<3.0" for child in (2 * i + 1, 2 * i + 2) if child < count]
+        graph[f"p{i}"] = {f"{ver}.0": deps for ver in (3, 2, 1)}
+
+    start = time.perf_counter()
+    solution = resolve(graph, ["p0"])
+    elapsed = time.perf_counter() - start
+
+    assert len(solution) == count
+    assert solution["p0"] == "3.0" and solution["p1"] == "2.0"
+    assert elapsed < 5.0, f"resolving {count} packages took {elapsed:.2f}s"
+
+
+@pytest.mark.parametrize("length", [20, 200])
+def test_fails_unsatisfiable_chain_in_budget(length):
+    # Every version of the last package conflicts with a root requirement,
+    # retrying all 3^length combinations of the chain would never finish
+    graph = chain_graph(length, ["base==2.0"])
+    graph["base"] = {"2.0": [], "1.0": []}
+
+    start = time.perf_counter()
+
+    with pytest.raises(ResolutionError, match="base"):
+        resolve(graph, ["p0", "base==1.0"])
+
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < 2.0, f"a chain of {length} took {elapsed:.2f}s to fail"
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from larch.session import http_get
+
+
+@pytest.fixture
+def local_file(tmp_path):
+    path = tmp_path / "remote.db"
+    path.write_bytes(b"catalog")
+    os.utime(path, (1700000000, 1700000000))
+
+    return path
+
+
+def test_sends_validators(local_file):
+    r = http_get(local_file.as_uri())
+
+    assert r.status_code == 200
+    assert r.content == b"catalog"
+    assert r.headers["ETag"]
+    assert r.headers["Last-Modified"] == "Tue, 14 Nov 2023 22:13:20 GMT"
+
+
+@pytest.mark.parametrize("validator", ["ETag", "Last-Modified"])
+def test_answers_not_modified(local_file, validator):
+    header = {"ETag": "If-None-Match", "Last-Modified": "If-Modified-Since"}[validator]
+    value = http_get(local_file.as_uri()).headers[validator]
+
+    r = http_get(local_file.as_uri(), headers={header: value})
+
+    assert r.status_code == 304
+    assert r.content == b""
+
+    local_file.write_bytes(b"new catalog")
+    os.utime(local_file, (1700000100, 1700000100))
+
+    r = http_get(local_file.as_uri(), headers={header: value})
+
+    assert r.status_code == 200
+    assert r.content == b"new catalog"
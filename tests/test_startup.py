@@ -0,0 +1,41 @@
+import statistics
+import sys
+import time
+
+import pytest
+
+# Seconds, generous enough for a slow CI machine. Most of it is the
+# interpreter and the SQLAlchemy import, a remote.db download or building the
+# dependency tree would blow it
+STARTUP_BUDGETS = {
+    ("--version",): 1.0,
+    ("list", "-i"): 2.0,
+    ("run", "demo"): 2.0,
+}
+
+
+def timed_run(run_larch, args, runs=3) -> float:
+    timings = []
+
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = run_larch(*args)
+        timings.append(time.perf_counter() - start)
+
+        assert result.returncode == 0, result.stderr
+
+    return statistics.median(timings)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="the entry point is a sh script")
+@pytest.mark.parametrize("args", list(STARTUP_BUDGETS), ids=" ".join)
+def test_lightweight_commands_fit_budget(larch_home, run_larch, demo_package, args):
+    elapsed = timed_run(run_larch, args)
+
+    assert (
+        elapsed < STARTUP_BUDGETS[args]
+    ), f"'larch {' '.join(args)}' took {elapsed:.2f}s"
+
+    # The repository is unreachable, none of them may have tried to use it
+    assert not (larch_home / ".larch" / "repos").exists()
+    assert not (larch_home / ".larch" / "remote.db").exists()
@@ -0,0 +1,151 @@
+import json
+import sqlite3
+import threading
+
+import pytest
+
+from larch import Repository
+from larch.commands.update import apply_deltas, fetch_remote_db, update_repo
+from larch.database.repos import get_remote_db_path
+
+DELTAS = [
+    {
+        "seq": 2,
+        "packages": {"added": [{"id": 2, "name": "b", "ver": "1.0", "arch": "any"}]},
+        "pkg_meta": {"added": [{"id": 2, "name": "b", "desc": "B"}]},
+    },
+    {
+        "seq": 3,
+        "packages": {
+            "changed": [{"id": 1, "name": "a", "ver": "1.1", "arch": "any"}],
+            "added": [{"id": 3, "name": "c", "ver": "1.0", "arch": "any"}],
+        },
+    },
+]
+
+
+def make_remote_db(path, seq: int):
+    with sqlite3.connect(path) as conn:
+        conn.executescript(
+            "CREATE TABLE packages (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, "
+            "ver VARCHAR NOT NULL, arch VARCHAR NOT NULL, ver_key VARCHAR NOT NULL, "
+            "UNIQUE (name, ver, arch));"
+            "CREATE TABLE pkg_meta (id INTEGER PRIMARY KEY, "
+            "name VARCHAR NOT NULL UNIQUE, desc VARCHAR NOT NULL);"
+            "CREATE TABLE db_meta (key VARCHAR PRIMARY KEY, value VARCHAR);"
+            "INSERT INTO packages VALUES (1, 'a', '1.0', 'any', '101 1010');"
+            "INSERT INTO pkg_meta VALUES (1, 'a', 'A');"
+            "PRAGMA user_version = 1;"
+        )
+        conn.execute("INSERT INTO db_meta VALUES ('seq', ?)", (str(seq),))
+    conn.close()
+
+
+def read_state(path):
+    with sqlite3.connect(path) as conn:
+        packages = conn.execute(
+            "SELECT name, ver FROM packages ORDER BY name"
+        ).fetchall()
+        seq = conn.execute("SELECT value FROM db_meta").fetchone()[0]
+    conn.close()
+
+    return packages, int(seq)
+
+
+@pytest.fixture
+def repo(repos_dir, http_server):
+    repo = Repository("main", http_server.url)
+    make_remote_db(get_remote_db_path(repo), 1)
+
+    return repo
+
+
+def test_applies_deltas(repo):
+    assert apply_deltas(repo, DELTAS) is True
+    assert read_state(get_remote_db_path(repo)) == (
+        [("a", "1.1"), ("b", "1.0"), ("c", "1.0")],
+        3,
+    )
+
+
+def test_skips_deltas_applied_meanwhile(repo):
+    apply_deltas(repo, DELTAS[:1])
+
+    assert apply_deltas(repo, DELTAS) is True
+    assert apply_deltas(repo, DELTAS) is False
+    assert read_state(get_remote_db_path(repo))[1] == 3
+
+
+def test_concurrent_updates_apply_once(repo):
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(apply_deltas(repo, DELTAS)))
+        for _ in range(4)
+    ]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == [False, False, False, True]
+    assert read_state(get_remote_db_path(repo))[1] == 3
+
+
+def test_replaces_rows_behind_stale_seq(repo):
+    apply_deltas(repo, DELTAS)
+
+    with sqlite3.connect(get_remote_db_path(repo)) as conn:
+        conn.execute("UPDATE db_meta SET value = '1'")
+    conn.close()
+
+    assert apply_deltas(repo, DELTAS) is True
+    assert len(read_state(get_remote_db_path(repo))[0]) == 3
+
+
+def test_broken_remote_db_is_fetched_in_full(repo, http_server, tmp_path):
+    (http_server.root / "deltas").mkdir()
+    (http_server.root / "deltas" / "latest").write_text("3")
+
+    for delta in DELTAS:
+        (http_server.root / "deltas" / f"{delta['seq']}.json").write_text(
+            json.dumps(delta)
+        )
+
+    make_remote_db(http_server.root / "remote.db", 3)
+
+    # Passes the sequence check, but the change sets cannot be applied to it
+    with sqlite3.connect(get_remote_db_path(repo)) as conn:
+        conn.execute("DROP TABLE pkg_meta")
+    conn.close()
+
+    assert update_repo(repo) is True
+    assert read_state(get_remote_db_path(repo)) == ([("a", "1.0")], 3)
+
+
+def test_failed_update_exits_with_error(run_larch):
+    result = run_larch("update")
+
+    assert result.returncode == 1
+    assert "could not be updated" in result.stdout
+
+
+def test_missing_catalog_is_not_replaced_by_empty_one(larch_home, run_larch):
+    for _ in range(2):
+        result = run_larch("install", "app")
+
+        assert result.returncode == 1
+        assert "no versions are available" not in result.stdout
+
+    assert not list((larch_home / ".larch").glob("repos/*/remote.db"))
+
+
+def test_unchanged_index_costs_single_request(repo, http_server):
+    make_remote_db(http_server.root / "remote.db", 3)
+
+    assert fetch_remote_db(repo) is True
+
+    http_server.requests.clear()
+
+    assert fetch_remote_db(repo) is False
+    assert [path for _, path, _ in http_server.requests] == ["/remote.db"]
@@ -0,0 +1,68 @@
+import random
+import time
+
+import pytest
+
+from larch.dep_tree.constraint import parse_requirement, version_satisfies
+from larch.dep_tree.version import Version
+
+
+def test_orders_numerically_and_text_first():
+    versions = ["1.10", "1.2", "1.0.a", "1.0", "1.0.1", "2.rc", "2.0"]
+
+    assert sorted(versions, key=Version) == [
+        "1.0",
+        "1.0.a",
+        "1.0.1",
+        "1.2",
+        "1.10",
+        "2.rc",
+        "2.0",
+    ]
+
+
+def test_db_key_sorts_like_key():
+    versions = ["1.10", "1.2", "1.0.a", "1.0", "1.0.1", "2.rc", "2.0", "10.0"]
+
+    assert sorted(versions, key=lambda ver: Version(ver).db_key) == sorted(
+        versions, key=Version
+    )
+
+
+@pytest.mark.parametrize(
+    "pkg_str, ver, expected",
+    [
+        ("lib>=1.2,<2.0", "1.10", True),
+        ("lib>=1.2,<2.0", "2.0", False),
+        ("lib==1.2.*", "1.2.7", True),
+        ("lib!=1.*", "1.4", False),
+        ("lib~=1.4", "1.9", True),
+        ("lib~=1.4", "2.0", False),
+        ("lib", "0.1", True),
+    ],
+)
+def test_version_satisfies(pkg_str, ver, expected):
+    assert version_satisfies(ver, parse_requirement(pkg_str).constraints) is expected
+
+
+def test_sorts_and_filters_many_versions_in_budget():
+    rng = random.Random(0)
+    versions = list(
+        {
+            f"{rng.randint(0, 30)}.{rng.randint(0, 30)}.{rng.randint(0, 60)}"
+            for _ in range(50000)
+        }
+    )
+    constraints = parse_requirement("lib>=3.1,<25.0,!=7.*").constraints
+
+    start = time.perf_counter()
+
+    for _ in range(5):
+        newest_first = sorted(versions, key=lambda ver: Version(ver).key, reverse=True)
+        suitable = [ver for ver in newest_first if version_satisfies(ver, constraints)]
+
+    elapsed = time.perf_counter() - start
+
+    assert Version(suitable[0]) < Version("25.0")
+    assert not any(ver.startswith("7.") for ver in suitable)
+    assert elapsed < 1.5, f"sorting and filtering took {elapsed:.2f}s"